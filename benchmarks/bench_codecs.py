@@ -0,0 +1,53 @@
+"""
+Encode/decode cost and stored size of the store codecs.
+
+Run from the repository root: python -m benchmarks.bench_codecs
+"""
+
+import json
+import pickle
+import timeit
+
+from scoring import scoring, store
+
+VALUES = {
+    "score": 3.5,
+    "interests json": json.dumps(["books", "hi-tech", "travel", "music"]).encode("utf-8"),
+    "interests list": ["books", "hi-tech", "travel", "music"],
+    "interests ids": scoring.pack_interests([1, 2, 4, 5]),
+}
+CODECS = {"raw": store.RAW, "json": store.JSON, "binary": store.BINARY}
+NUMBER = 100000
+
+
+def bench_pickle(value):
+    data = pickle.dumps(value)
+    encode = timeit.timeit(lambda: pickle.dumps(value), number=NUMBER)
+    decode = timeit.timeit(lambda: pickle.loads(data), number=NUMBER)
+    return len(data), encode, decode
+
+
+def bench_codec(codec, value):
+    try:
+        data = store.encode_value(value, codec)
+    except (TypeError, ValueError):
+        return None
+    encode = timeit.timeit(lambda: store.encode_value(value, codec), number=NUMBER)
+    decode = timeit.timeit(lambda: store.decode_value(data), number=NUMBER)
+    return len(data), encode, decode
+
+
+def main():
+    print(f"{'value':<16} {'codec':<8} {'bytes':>6} {'encode, us':>11} {'decode, us':>11}")
+    for name, value in VALUES.items():
+        results = {"pickle": bench_pickle(value)}
+        results.update((codec_name, bench_codec(codec, value)) for codec_name, codec in CODECS.items())
+        for codec_name, result in results.items():
+            if result is None:
+                continue
+            size, encode, decode = result
+            print(f"{name:<16} {codec_name:<8} {size:>6} {encode / NUMBER * 1e6:>11.3f} {decode / NUMBER * 1e6:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Microbenchmarks of the request path without I/O: method_handler, get_score, get_interests.
+Validation alone is measured by benchmarks/bench_validation.py.
+
+Run from the repository root: python -m benchmarks.bench_handlers
+"""
+
+import logging
+import timeit
+
+from benchmarks.common import DictStore, clients_interests_request, online_score_request, seed_interests
+from scoring import api, scoring
+
+NUMBER = 20000
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    store = DictStore()
+    seed_interests(store.cache_set)
+    score_request = online_score_request()
+    interests_request = clients_interests_request()
+    api.method_handler({"body": score_request, "headers": {}}, {}, store)
+
+    cases = {
+        "method_handler online_score": lambda: api.method_handler({"body": score_request, "headers": {}}, {}, store),
+        "method_handler clients_interests": lambda: api.method_handler(
+            {"body": interests_request, "headers": {}}, {}, store
+        ),
+        "get_score cached": lambda: scoring.get_score(store, "79175002040", "stupnikov@otus.ru"),
+        "get_score uncached": lambda: scoring.get_score(DictStore(), "79175002040", "stupnikov@otus.ru"),
+        "get_interests": lambda: scoring.get_interests(store, 1),
+        "get_interests_many x10": lambda: scoring.get_interests_many(store, list(range(10))),
+    }
+    for name, case in cases.items():
+        seconds = min(timeit.repeat(case, number=NUMBER, repeat=3))
+        print(f"{name:<34} {seconds / NUMBER * 1e6:8.3f} us")
+
+
+if __name__ == "__main__":
+    main()
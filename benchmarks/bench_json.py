@@ -0,0 +1,36 @@
+"""
+Request body parsing and response serialization with each installed JSON codec.
+
+Run from the repository root: python -m benchmarks.bench_json
+"""
+
+import json
+import timeit
+
+from scoring import jsoncodec
+
+from .common import clients_interests_request, online_score_request
+
+NUMBER = 20000
+CLIENTS = 1000
+
+INTERESTS = ["books", "hi-tech", "pets", "tv", "travel", "music", "cinema", "geek", "sport", "otus"]
+CASES = {
+    "online_score": (online_score_request(), {"code": 200, "response": {"score": 5.0}}),
+    "clients_interests": (
+        clients_interests_request(size=CLIENTS),
+        {"code": 200, "response": {str(cid): [INTERESTS[cid % 10], INTERESTS[cid % 7]] for cid in range(CLIENTS)}},
+    ),
+}
+
+
+def main():
+    for name, (request, response) in CASES.items():
+        body = json.dumps(request, ensure_ascii=False).encode("utf-8")
+        for codec in jsoncodec.CODECS.values():
+            seconds = min(timeit.repeat(lambda: codec.dumps(response) and codec.loads(body), number=NUMBER, repeat=3))
+            print(f"{name:<18} {codec.name:<8} {seconds / NUMBER * 1e6:9.3f} us per request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Validation cost per request for the online_score and clients_interests argument schemas.
+
+Run from the repository root: python -m benchmarks.bench_validation
+"""
+
+import timeit
+
+from scoring import api
+
+ONLINE_SCORE = {
+    "phone": "79175002040",
+    "email": "stupnikov@otus.ru",
+    "first_name": "Станислав",
+    "last_name": "Ступников",
+    "birthday": "01.01.1990",
+    "gender": 1,
+}
+CLIENTS_INTERESTS = {"client_ids": [1, 2, 3, 4], "date": "20.07.2017"}
+METHOD = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "arguments": ONLINE_SCORE}
+METHOD["token"] = (
+    "55cc9ce545bcd144300fe9efc28e65d415b923ebb6be1e19d2750a2c03e80dd2"
+    "09a27954dca045e5bb12418e7d89b6d718a9e35af34e14e1d5bcd5a08f21fc95"
+)
+NUMBER = 100000
+
+CASES = {
+    "online_score": lambda: api.OnlineScoreRequest(ONLINE_SCORE),
+    "clients_interests": lambda: api.ClientsInterestsRequest(CLIENTS_INTERESTS),
+    "method": lambda: api.MethodRequest(METHOD),
+}
+
+
+def main():
+    for name, case in CASES.items():
+        seconds = min(timeit.repeat(case, number=NUMBER, repeat=3))
+        print(f"{name:<18} {seconds / NUMBER * 1e6:8.3f} us per request")
+
+
+if __name__ == "__main__":
+    main()
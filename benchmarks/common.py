@@ -0,0 +1,75 @@
+import datetime
+import hashlib
+import json
+
+from scoring import api, store
+
+
+class DictStore(store.Store):
+    """
+    Dict-backed store without expiration, to benchmark request handling without any I/O.
+    """
+
+    _shared = False
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def get_many(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def cache_get(self, key):
+        return self.values.get(key)
+
+    def cache_set(self, key, value, cache_duration=60):
+        self.values[key] = value
+
+    def expire_prefix(self, prefix, cache_duration):
+        # Nothing expires here, the keys are only counted
+        return sum(1 for key in self.values if isinstance(key, str) and key.startswith(prefix))
+
+    def check(self):
+        return True
+
+
+def seed_interests(cache_set, clients=1000):
+    """
+    Store interests for client ids 0..clients-1 with the given cache_set callable.
+    """
+    interests = ["books", "hi-tech", "pets", "tv", "travel", "music", "cinema", "geek", "sport", "otus"]
+    for cid in range(clients):
+        value = json.dumps([interests[cid % len(interests)], interests[(cid * 7 + 3) % len(interests)]])
+        cache_set(f"i:{cid}", value.encode("utf-8"), 24 * 60 * 60)
+
+
+def method_request(method, arguments, login="h&f"):
+    request = {"account": "horns&hoofs", "login": login, "method": method, "arguments": arguments}
+    if login == api.ADMIN_LOGIN:
+        msg = datetime.datetime.today().strftime("%Y%m%d%H") + api.ADMIN_SALT
+    else:
+        msg = request["account"] + login + api.SALT
+    request["token"] = hashlib.sha512(msg.encode("utf-8")).hexdigest()
+    return request
+
+
+ONLINE_SCORE_ARGUMENTS = {
+    "phone": "79175002040",
+    "email": "stupnikov@otus.ru",
+    "first_name": "Станислав",
+    "last_name": "Ступников",
+    "birthday": "01.01.1990",
+    "gender": 1,
+}
+
+
+def online_score_request(i=0):
+    # Vary the phone, so requests hit different score cache keys
+    return method_request("online_score", dict(ONLINE_SCORE_ARGUMENTS, phone=str(79175000000 + i % 10000)))
+
+
+def clients_interests_request(i=0, clients=1000, size=10):
+    client_ids = [(i + j) % clients for j in range(size)]
+    return method_request("clients_interests", {"client_ids": client_ids, "date": "20.07.2017"})
@@ -0,0 +1,147 @@
+"""
+In-process Redis stand-in that speaks enough RESP for RedisStore: strings with expiration,
+MGET/MSET, pipelines and MULTI/EXEC.
+Both RESP2 and RESP3 clients are supported. Used to run the benchmarks without a Redis server.
+
+Run standalone: python -m benchmarks.fake_redis --port 6399
+"""
+
+import socketserver
+import threading
+import time
+from argparse import ArgumentParser
+
+
+class FakeRedisData:
+    def __init__(self):
+        self.values = {}  # key -> (value, expires_at or None)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        entry = self.values.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self.values[key]
+            return None
+        return entry[0]
+
+    def set(self, key, value, ttl=None):
+        self.values[key] = (value, None if ttl is None else time.monotonic() + ttl)
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    protocol = 2  # Switched by HELLO, RESP3 only differs in how nil is encoded here
+
+    def handle(self):
+        queued = None
+        while True:
+            try:
+                command = self.read_command()
+            except (ConnectionError, ValueError):
+                return
+            if command is None:
+                return
+            name = command[0].upper()
+            if name == b"MULTI":
+                queued = []
+                self.wfile.write(b"+OK\r\n")
+            elif name == b"EXEC" and queued is not None:
+                replies = [self.execute(queued_command) for queued_command in queued]
+                self.wfile.write(b"*%d\r\n" % len(replies) + b"".join(replies))
+                queued = None
+            elif queued is not None:
+                queued.append(command)
+                self.wfile.write(b"+QUEUED\r\n")
+            else:
+                self.wfile.write(self.execute(command))
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()  # Inline command, e.g. from redis-cli or telnet
+        command = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            command.append(self.rfile.read(length + 2)[:-2])
+        return command
+
+    def execute(self, command):
+        data = self.server.data
+        name, args = command[0].upper(), command[1:]
+        with data.lock:
+            if name == b"PING":
+                return b"+PONG\r\n"
+            if name == b"HELLO":
+                self.protocol = int(args[0]) if args else self.protocol
+                if self.protocol == 3:
+                    return b"%%2\r\n+server\r\n+redis\r\n+proto\r\n:%d\r\n" % self.protocol
+                return b"*4\r\n$6\r\nserver\r\n$5\r\nredis\r\n$5\r\nproto\r\n:%d\r\n" % self.protocol
+            if name in (b"SELECT", b"FLUSHDB", b"CLIENT"):
+                if name == b"FLUSHDB":
+                    data.values.clear()
+                return b"+OK\r\n"
+            if name == b"GET":
+                return self.bulk(data.get(args[0]))
+            if name == b"MGET":
+                return b"*%d\r\n" % len(args) + b"".join(self.bulk(data.get(key)) for key in args)
+            if name == b"SET":
+                ttl = None
+                options = [option.upper() for option in args[2:]]
+                if b"EX" in options:
+                    ttl = int(args[2 + options.index(b"EX") + 1])
+                elif b"PX" in options:
+                    ttl = int(args[2 + options.index(b"PX") + 1]) / 1000
+                data.set(args[0], args[1], ttl)
+                return b"+OK\r\n"
+            if name == b"SETEX":
+                data.set(args[0], args[2], int(args[1]))
+                return b"+OK\r\n"
+            if name == b"MSET":
+                for key, value in zip(args[::2], args[1::2]):
+                    data.set(key, value)
+                return b"+OK\r\n"
+            if name == b"DEL":
+                return b":%d\r\n" % sum(data.values.pop(key, None) is not None for key in args)
+            if name == b"EXISTS":
+                return b":%d\r\n" % sum(data.get(key) is not None for key in args)
+            if name in (b"TTL", b"PTTL"):
+                if data.get(args[0]) is None:
+                    return b":-2\r\n"
+                expires_at = data.values[args[0]][1]
+                if expires_at is None:
+                    return b":-1\r\n"
+                remaining = expires_at - time.monotonic()
+                return b":%d\r\n" % (remaining * 1000 if name == b"PTTL" else remaining)
+        return b"-ERR unknown command '%s'\r\n" % name
+
+    def bulk(self, value):
+        if value is None:
+            return b"_\r\n" if self.protocol == 3 else b"$-1\r\n"
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=("localhost", 0)):
+        super().__init__(address, FakeRedisHandler)
+        self.data = FakeRedisData()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-redis", daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-p", "--port", action="store", type=int, default=6399)
+    args = parser.parse_args()
+    FakeRedisServer(("localhost", args.port)).serve_forever()
@@ -0,0 +1,218 @@
+"""
+HTTP load generator for the /method endpoint.
+
+Closed loop: `--concurrency` clients send requests back to back over keep-alive connections.
+Open loop: requests are scheduled at a fixed `--rate` and latency is measured from the scheduled
+send time, so a slow server can't hide its queueing delay.
+
+With --start-server the script starts an in-process fake Redis, seeds interests and launches
+runserver.py with the given server arguments, so results are reproducible offline:
+
+    python -m benchmarks.loadgen --start-server --duration 10 --concurrency 16 -- --workers 8
+    python -m benchmarks.loadgen --mode open --rate 500 --url http://localhost:8080 --json result.json
+"""
+
+import http.client
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from argparse import REMAINDER, ArgumentParser
+from urllib.parse import urlsplit
+
+from benchmarks.common import clients_interests_request, online_score_request, seed_interests
+from benchmarks.fake_redis import FakeRedisServer
+from scoring import store
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Client:
+    def __init__(self, url, path="/method"):
+        parts = urlsplit(url)
+        self.host, self.port, self.path = parts.hostname, parts.port or 80, path
+        self.connection = None
+
+    def post(self, body):
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            try:
+                self.connection.request("POST", self.path, body=body, headers={"Content-Type": "application/json"})
+                response = self.connection.getresponse()
+                response.read()
+                if response.getheader("Connection", "").lower() == "close" or response.version == 10:
+                    self.connection.close()
+                    self.connection = None
+                return response.status
+            except (OSError, http.client.HTTPException):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = []
+        self.codes = {}
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def record(self, latency, code):
+        with self.lock:
+            self.latencies.append(latency)
+            self.codes[code] = self.codes.get(code, 0) + 1
+
+    def error(self):
+        with self.lock:
+            self.errors += 1
+
+
+def make_bodies(method, count=1000):
+    requests = {
+        "online_score": [online_score_request(i) for i in range(count)],
+        "clients_interests": [clients_interests_request(i) for i in range(count)],
+    }
+    if method == "mixed":
+        bodies = [r for pair in zip(requests["online_score"], requests["clients_interests"]) for r in pair]
+    else:
+        bodies = requests[method]
+    return [json.dumps(body).encode("utf-8") for body in bodies]
+
+
+def run_closed(url, bodies, concurrency, duration, recorder):
+    deadline = time.perf_counter() + duration
+
+    def worker(offset):
+        client, i = Client(url), offset
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                code = client.post(bodies[i % len(bodies)])
+            except (OSError, http.client.HTTPException):
+                recorder.error()
+            else:
+                recorder.record(time.perf_counter() - started, code)
+            i += concurrency
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_open(url, bodies, concurrency, duration, rate, recorder):
+    schedule = queue.Queue()
+
+    def worker():
+        client = Client(url)
+        while True:
+            item = schedule.get()
+            if item is None:
+                return
+            scheduled, body = item
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                code = client.post(body)
+            except (OSError, http.client.HTTPException):
+                recorder.error()
+            else:
+                recorder.record(time.perf_counter() - scheduled, code)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    started = time.perf_counter()
+    for i in range(int(duration * rate)):
+        scheduled = started + i / rate
+        # Feed the queue slightly ahead of time, so idle workers are ready to send on schedule
+        while scheduled - time.perf_counter() > 0.05:
+            time.sleep(0.01)
+        schedule.put((scheduled, bodies[i % len(bodies)]))
+    for _ in threads:
+        schedule.put(None)
+    for thread in threads:
+        thread.join()
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def summarize(recorder, elapsed):
+    latencies = sorted(recorder.latencies)
+    return {
+        "requests": len(latencies),
+        "errors": recorder.errors,
+        "codes": {str(code): count for code, count in sorted(recorder.codes.items())},
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+    }
+
+
+def start_server(port, server_args):
+    redis = FakeRedisServer().start()
+    seed_interests(store.RedisStore(port=redis.port, health_interval=0).cache_set)
+    command = [sys.executable, "runserver.py", "-p", str(port), "--redis-port", str(redis.port), *server_args]
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            http.client.HTTPConnection("localhost", port, timeout=1).connect()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Server didn't start")
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--mode", choices=("closed", "open"), default="closed")
+    parser.add_argument("--method", choices=("online_score", "clients_interests", "mixed"), default="mixed")
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("-d", "--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("-r", "--rate", type=float, default=200.0, help="requests per second in open loop mode")
+    parser.add_argument("--start-server", action="store_true", help="run runserver.py against a fake Redis")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("server_args", nargs=REMAINDER, help="runserver.py arguments after --")
+    args = parser.parse_args()
+
+    process = None
+    if args.start_server:
+        port = urlsplit(args.url).port or 8080
+        process = start_server(port, [arg for arg in args.server_args if arg != "--"])
+    try:
+        recorder = Recorder()
+        bodies = make_bodies(args.method)
+        started = time.perf_counter()
+        if args.mode == "closed":
+            run_closed(args.url, bodies, args.concurrency, args.duration, recorder)
+        else:
+            run_open(args.url, bodies, args.concurrency, args.duration, args.rate, recorder)
+        result = summarize(recorder, time.perf_counter() - started)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    result.update(mode=args.mode, method=args.method, concurrency=args.concurrency, server_args=args.server_args)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import csv
+import json
+import logging
+import multiprocessing
+import sys
+import time
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from scoring import api, cli, keys, scoring, store
+
+worker_store = None
+
+
+def init_worker(args, backend=None):
+    global worker_store
+    worker_store = cli.build_store(args, backend)
+
+
+def read_rows(stream, input_format):
+    """
+    Yield (line number, online_score arguments or an error message) for every input row.
+    """
+    if input_format == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            # Empty cells are missing values, gender comes as text
+            arguments = {name: value for name, value in row.items() if name and value not in ("", None)}
+            if "gender" in arguments and arguments["gender"].lstrip("-").isdigit():
+                arguments["gender"] = int(arguments["gender"])
+            yield reader.line_num, arguments
+        return
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            arguments = json.loads(line)
+        except ValueError as e:
+            yield number, f"Некорректный JSON: {e}"
+            continue
+        yield number, arguments if isinstance(arguments, dict) else "Строка должна быть JSON-объектом"
+
+
+def score_chunk(chunk):
+    """
+    Validate a chunk of rows like OnlineScoreRequest does and score the valid ones with one bulk cache read.
+    Returns (scores as (line, score), rejects as (line, arguments, error)).
+    """
+    valid, rejects = [], []
+    for number, arguments in chunk:
+        if isinstance(arguments, str):
+            rejects.append((number, None, arguments))
+            continue
+        try:
+            valid.append((number, api.OnlineScoreRequest(arguments)))
+        except (ValueError, KeyError, TypeError) as e:
+            rejects.append((number, arguments, str(e)))
+    scores = scoring.get_scores(worker_store, [request.score_arguments() for _, request in valid])
+    return [(number, score) for (number, _), score in zip(valid, scores)], rejects
+
+
+def chunked(rows, chunk_size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunk_size)):
+        yield chunk
+
+
+def score_chunks(chunks, workers, args, backend=None):
+    """
+    Score chunks in a pool of `workers` processes, 0 scores in this process.
+    Results come in input order and at most two chunks per worker are in flight,
+    so memory use doesn't depend on the input size.
+    """
+    if not workers:
+        init_worker(args, backend)
+        yield from map(score_chunk, chunks)
+        return
+    context = multiprocessing.get_context("fork")  # Workers inherit the in-memory backend
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker, initargs=(args, backend)) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(score_chunk, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class Progress:
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self.rows = 0
+        self.rejected = 0
+        self.started = self.reported = time.monotonic()
+
+    def update(self, scored, rejected):
+        self.rows += scored + rejected
+        self.rejected += rejected
+        if time.monotonic() - self.reported >= self.interval:
+            self.report()
+
+    def report(self):
+        self.reported = time.monotonic()
+        elapsed = self.reported - self.started
+        logging.info(
+            "%d rows, %d rejected, %.0f rows/s", self.rows, self.rejected, self.rows / elapsed if elapsed else 0.0
+        )
+
+
+def run(args, backend=None):
+    input_format = args.format or ("csv" if args.input.endswith(".csv") else "jsonl")
+    source = sys.stdin if args.input == "-" else open(args.input, newline="", encoding="utf-8")
+    output = sys.stdout if args.output == "-" else open(args.output, "w", newline="", encoding="utf-8")
+    rejects = open(args.rejects, "w", encoding="utf-8")
+    progress = Progress(args.progress_interval)
+    try:
+        writer = csv.writer(output) if input_format == "csv" else None
+        if writer:
+            writer.writerow(("line", "score"))
+        rows = read_rows(source, input_format)
+        for scores, rejected in score_chunks(chunked(rows, args.chunk_size), args.workers, args, backend):
+            for number, score in scores:
+                if writer:
+                    writer.writerow((number, score))
+                else:
+                    output.write(json.dumps({"line": number, "score": score}) + "\n")
+            for number, arguments, error in rejected:
+                rejects.write(json.dumps({"line": number, "row": arguments, "error": error}, ensure_ascii=False) + "\n")
+            progress.update(len(scores), len(rejected))
+    finally:
+        for stream in (source, output):
+            if stream not in (sys.stdin, sys.stdout):
+                stream.close()
+        rejects.close()
+    progress.report()
+    return progress
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Score a CSV or JSONL file of online_score arguments")
+    parser.add_argument("input", help="input file, - reads stdin")
+    parser.add_argument("-o", "--output", action="store", default="-", help="scores file, - writes stdout")
+    parser.add_argument("--rejects", action="store", default="rejects.jsonl", help="invalid rows with their errors")
+    parser.add_argument(
+        "--format", action="store", choices=("csv", "jsonl"), default=None, help="default: by extension"
+    )
+    parser.add_argument("-w", "--workers", action="store", type=int, default=0, help="0 scores in this process")
+    parser.add_argument("--chunk-size", action="store", type=int, default=1000)
+    parser.add_argument("--progress-interval", action="store", type=float, default=5.0, help="seconds between reports")
+    cli.add_store_arguments(parser)
+    parser.add_argument("--legacy-score-keys", action="store_true", help="also read scores cached by older versions")
+    args = parser.parse_args()
+    cli.check_store_arguments(parser, args)
+    keys.READ_LEGACY_KEYS = args.legacy_score_keys  # Forked workers inherit it
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname).1s %(message)s",
+        datefmt="%Y.%m.%d %H:%M:%S",
+        handlers=[logging.StreamHandler()],
+    )
+    run(args, None if args.store == "redis" else store.create_store(args.store))
@@ -0,0 +1,57 @@
+import json
+import logging
+import time
+from argparse import ArgumentParser
+
+from scoring import cli, loader
+
+
+def read_records(stream):
+    """
+    Yield (cid, interests) from JSONL lines like {"cid": 1, "interests": ["books", "travel"]}.
+    """
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if not isinstance(record.get("cid"), int) or not isinstance(record.get("interests"), list):
+            raise ValueError(f"Line {number}: expected an integer cid and a list of interests")
+        yield record["cid"], record["interests"]
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Load client interests from a JSONL file as a new dataset version")
+    parser.add_argument("input", help="JSONL file with cid and interests per line")
+    parser.add_argument("--version", action="store", default=None, help="default: current time")
+    parser.add_argument("--batch-size", action="store", type=int, default=1000, help="keys per pipelined write")
+    parser.add_argument("--workers", action="store", type=int, default=4, help="batches written in parallel")
+    parser.add_argument("--ttl", action="store", type=int, default=None, help="seconds the replaced version is kept")
+    parser.add_argument("--pause", action="store", type=float, default=0.0, help="seconds between batches")
+    parser.add_argument(
+        "--bloom-error-rate", action="store", type=float, default=None, help="write a Bloom filter of loaded ids"
+    )
+    parser.add_argument("--plain", action="store_true", help="store lists of names instead of vocabulary ids")
+    cli.add_store_arguments(parser, redis_only=True)
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname).1s %(message)s",
+        datefmt="%Y.%m.%d %H:%M:%S",
+        handlers=[logging.StreamHandler()],
+    )
+    start = time.monotonic()
+    with open(args.input, encoding="utf-8") as stream:
+        loader.load_interests(
+            # Writes go to the primary without a local cache. Versioned interests are read only by servers
+            # that know the tagged formats, and the pointer written in them is read back without pickle
+            cli.build_store(args, redis_replicas="", local_cache_mb=0, value_format="binary", legacy_pickle=False),
+            read_records(stream),
+            version=args.version,
+            batch_size=args.batch_size,
+            workers=args.workers,
+            ttl=args.ttl,
+            pause=args.pause,
+            packed=not args.plain,
+            bloom_error_rate=args.bloom_error_rate,
+        )
+    logging.info("Done in %.1fs", time.monotonic() - start)
@@ -1,26 +1,96 @@
+import asyncio
 import logging
 from argparse import ArgumentParser
-from http.server import HTTPServer
 
-from scoring import api
+from scoring import api, asyncserver, cli, jsoncodec, keys, logs, metrics, scoring, server, store
+
+
+def init_worker(args, backend=None):
+    api.MainHTTPHandler.store = cli.build_store(args, backend)
+
+
+async def serve_async(args):
+    async_store = store.AsyncRedisStore(
+        host=args.redis_host,
+        port=args.redis_port,
+        codec=store.VALUE_FORMATS[args.value_format],
+        legacy_pickle=args.legacy_pickle,
+    )
+    async_store.start_health_probe()
+    await asyncserver.serve("localhost", args.port, async_store)
+
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("-p", "--port", action="store", type=int, default=8080)
     parser.add_argument("-l", "--log", action="store", default=None)
+    cli.add_store_arguments(parser)
+    parser.add_argument("-w", "--workers", action="store", type=int, default=0, help="0 serves requests serially")
+    parser.add_argument("--mode", action="store", choices=("thread", "process"), default="thread")
+    parser.add_argument("--queue-size", action="store", type=int, default=64, help="connections waiting for a thread")
+    parser.add_argument("--asyncio", action="store_true", help="serve all connections from one asyncio event loop")
+    parser.add_argument(
+        "--early-refresh-beta", action="store", type=float, default=0.0, help="refresh hot scores before expiry"
+    )
+    parser.add_argument("--legacy-score-keys", action="store_true", help="also read scores cached by older versions")
+    parser.add_argument(
+        "--negative-cache-ttl", action="store", type=float, default=5.0, help="seconds missing ids aren't read again"
+    )
+    parser.add_argument(
+        "--stream-threshold", action="store", type=int, default=0, help="stream clients_interests above N ids"
+    )
+    parser.add_argument("--metrics", action="store_true", help="collect timings and serve them on GET /metrics")
+    parser.add_argument(
+        "--json-codec", action="store", choices=tuple(jsoncodec.CODECS), default=None, help="default: fastest installed"
+    )
+    parser.add_argument("--log-format", action="store", choices=("text", "json"), default="text")
+    parser.add_argument(
+        "--log-sample-rate", action="store", type=float, default=1.0, help="share of successful requests logged"
+    )
+    parser.add_argument(
+        "--log-queue-size", action="store", type=int, default=10000, help="records waiting to be written, then dropped"
+    )
     args = parser.parse_args()
-    logging.basicConfig(
-        # filename=args.log,
-        level=logging.INFO,
-        format="[%(asctime)s] %(levelname).1s %(message)s",
-        datefmt="%Y.%m.%d %H:%M:%S",
-        handlers=[logging.StreamHandler()],
-    )
-
-    server = HTTPServer(("localhost", args.port), api.MainHTTPHandler)
-    logging.info("Starting server at %s" % args.port)
-    try:
-        server.serve_forever()
-    except KeyboardInterrupt:
-        pass
+    cli.check_store_arguments(parser, args)
+    if args.asyncio:
+        # The asyncio server has a single Redis connection and no store wrappers, workers or streaming
+        for name in ("store", "redis_nodes", "redis_replicas", "local_cache_mb", "workers", "stream_threshold"):
+            if getattr(args, name) != parser.get_default(name):
+                parser.error(f"--{name.replace('_', '-')} is not supported with --asyncio")
+    scoring.EARLY_REFRESH_BETA = args.early_refresh_beta
+    scoring.NEGATIVE_CACHE_TTL = args.negative_cache_ttl
+    keys.READ_LEGACY_KEYS = args.legacy_score_keys
+    api.STREAM_THRESHOLD = args.stream_threshold
+    metrics.ENABLED = args.metrics
+    api.MainHTTPHandler.codec = asyncserver.codec = jsoncodec.get_codec(args.json_codec)
+    logs.setup_logging(
+        filename=args.log,
+        json_format=args.log_format == "json",
+        queue_size=args.log_queue_size,
+        sample_rate=args.log_sample_rate,
+    )
+
+    if args.asyncio:
+        logging.info("Starting asyncio server at %s", args.port)
+        try:
+            asyncio.run(serve_async(args))
+        except KeyboardInterrupt:
+            pass
+    else:
+        backend = None if args.store == "redis" else store.create_store(args.store)
+        if args.workers and args.mode == "thread":
+            httpd = server.ThreadPoolHTTPServer(
+                ("localhost", args.port), api.MainHTTPHandler, workers=args.workers, queue_size=args.queue_size
+            )
+        else:
+            httpd = server.SerialHTTPServer(("localhost", args.port), api.MainHTTPHandler)
+        logging.info("Starting server at %s", args.port)
+        try:
+            if args.workers and args.mode == "process":
+                server.serve_prefork(httpd, args.workers, init_worker=lambda: init_worker(args, backend))
+            else:
+                init_worker(args, backend)
+                httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
     # server.server_close()
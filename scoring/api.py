@@ -1,11 +1,16 @@
 ﻿import datetime
+import functools
 import hashlib
-import json
+import hmac
 import logging
+import re
+import threading
+import time
 import uuid
+from collections import OrderedDict
 from http.server import BaseHTTPRequestHandler
 
-from scoring import scoring, store
+from scoring import jsoncodec, metrics, scoring
 
 SALT = "Otus"
 ADMIN_LOGIN = "admin"
@@ -14,15 +19,24 @@ OK = 200
 BAD_REQUEST = 400
 FORBIDDEN = 403
 NOT_FOUND = 404
+METHOD_NOT_ALLOWED = 405
 INVALID_REQUEST = 422
 INTERNAL_ERROR = 500
+SERVICE_UNAVAILABLE = 503
 ERRORS = {
     BAD_REQUEST: "Bad Request",
     FORBIDDEN: "Forbidden",
     NOT_FOUND: "Not Found",
+    METHOD_NOT_ALLOWED: "Method Not Allowed",
     INVALID_REQUEST: "Invalid Request",
     INTERNAL_ERROR: "Internal Server Error",
+    SERVICE_UNAVAILABLE: "Service Unavailable",
 }
+METHODS = ("online_score", "clients_interests")
+# clients_interests requests with more ids are answered with a stream, 0 disables streaming.
+# A streamed response can't fail on missing ids, so it changes the API and is opt-in.
+STREAM_THRESHOLD = 0
+STREAM_BATCH_SIZE = 1000  # Ids read from the store and encoded per chunk
 UNKNOWN = 0
 MALE = 1
 FEMALE = 2
@@ -38,189 +52,390 @@ class AccessError(Exception):
 
 
 class Field:
-    def __init__(self, value, required, nullable) -> None:
+    """
+    Request field declaration. Fields are declared once on a Request class,
+    `clean` validates a raw value and returns the value stored on the request.
+    """
+
+    empty = None  # Value of a missing optional field
+
+    def __init__(self, required=False, nullable=True) -> None:
         self.required = required
         self.nullable = nullable
-        self.value = value
 
-    @property
-    def value(self):
-        return self._value
+    def clean(self, value):
+        if value is None:
+            if self.required:
+                raise ValueError(f"Значение не может быть пустым: {self.__class__.__name__}")
+            return self.empty
+        return self.validate(value)
 
-    @value.setter
-    def value(self, value):
-        if value is not None or self.nullable:
-            self._value = value
-        if value is None and self.required:
-            raise ValueError(f"Значение не может быть пустым: {self.__class__.__name__}")
+    def validate(self, value):
+        return value
 
 
 class CharField(Field):
-    def __init__(self, value, required, nullable) -> None:
-        super().__init__(value, required, nullable)
-        if self._value is not None:
-            if not isinstance(value, str):
-                raise ValueError("Значение должно быть строкой", value)
-        else:
-            self._value = ""
+    empty = ""
+
+    def validate(self, value):
+        if not isinstance(value, str):
+            raise ValueError("Значение должно быть строкой", value)
+        return value
 
 
 class ArgumentsField(Field):
-    def __init__(self, value: dict, required, nullable) -> None:
-        super().__init__(value, required, nullable)
+    def validate(self, value):
+        if not isinstance(value, dict):
+            raise ValueError("Аргументы должны быть объектом")
+        return value
 
 
 class EmailField(CharField):
-    def __init__(self, value, required, nullable) -> None:
-        super().__init__(value, required, nullable)
-        if self.value:
-            self._validate()
-
-    def _validate(self):
-        if "@" not in self.value:
+    def validate(self, value):
+        value = super().validate(value)
+        if value and "@" not in value:
             raise ValueError("Некорректный email")
+        return value
 
 
 class PhoneField(Field):
-    def __init__(self, value, required, nullable) -> None:
-        super().__init__(value, required, nullable)
-        if self._value:
-            self._value = str(self._value)
-            self._validate()
-
-    def _validate(self):
-        if not (len(self._value) == 11 and self._value.startswith("7") and self._value.isdigit()):
+    def validate(self, value):
+        if not value:
+            return value
+        value = str(value)
+        if not (len(value) == 11 and value.startswith("7") and value.isdigit()):
             raise ValueError("Некорректный номер телефона")
+        return value
+
+
+# Same patterns as strptime uses for "%d.%m.%Y"
+DATE_RE = re.compile(r"(3[01]|[12]\d|0[1-9]|[1-9]| [1-9])\.(1[0-2]|0[1-9]|[1-9])\.(\d\d\d\d)")
+MAX_BIRTHDAY_AGE = datetime.timedelta(days=70 * 365.25)
+_birthday_cutoff = (float("-inf"), None)  # (valid until timestamp, earliest accepted birthday)
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_date(value):
+    """
+    Parse a DD.MM.YYYY date, accepting exactly what datetime.strptime(value, "%d.%m.%Y") accepts.
+    """
+    match = DATE_RE.fullmatch(value)
+    if match is None:
+        raise ValueError(f"time data {value!r} does not match format '%d.%m.%Y'")
+    day, month, year = match.groups()
+    return datetime.datetime(int(year), int(month), int(day))
+
+
+def birthday_cutoff():
+    """
+    Earliest accepted birthday, i.e. `today - MAX_BIRTHDAY_AGE` rounded up to midnight.
+    Birthdays are midnight dates, so comparing with it gives the same result as comparing with the exact bound,
+    and it only has to be recomputed once a day.
+    """
+    global _birthday_cutoff
+    valid_until, cutoff = _birthday_cutoff
+    if time.time() > valid_until:
+        bound = datetime.datetime.today() - MAX_BIRTHDAY_AGE
+        cutoff = bound.replace(hour=0, minute=0, second=0, microsecond=0)
+        if cutoff < bound:
+            cutoff += datetime.timedelta(days=1)
+        _birthday_cutoff = (cutoff + MAX_BIRTHDAY_AGE).timestamp(), cutoff
+    return cutoff
 
 
 class DateField(CharField):
-    def __init__(self, value, required, nullable) -> None:
-        super().__init__(value, required, nullable)
-        if self._value:
-            self._validate()
+    def validate(self, value):
+        value = super().validate(value)
+        if value:
+            self.parse(value)
+        return value
 
-    def _validate(self):
+    def parse(self, value):
         try:
-            datetime.datetime.strptime(self._value, "%d.%m.%Y")
+            return parse_date(value)
         except ValueError:
             raise ValueError("Некорректный формат даты")
 
 
 class BirthDayField(DateField):
-    def __init__(self, value, required, nullable) -> None:
-        super().__init__(value, required, nullable)
-        if self._value:
-            self._validate()
-
-    def _validate(self):
-        super()._validate()
-        date_tmp = datetime.datetime.strptime(self._value, "%d.%m.%Y")
-        seventy_years_ago = datetime.datetime.today() - datetime.timedelta(days=70 * 365.25)
-        if date_tmp < seventy_years_ago:
+    def validate(self, value):
+        value = CharField.validate(self, value)
+        if value and self.parse(value) < birthday_cutoff():
             raise ValueError("Некорректная дата рождения")
+        return value
 
 
 class GenderField(Field):
-    def __init__(self, value, required, nullable) -> None:
-        super().__init__(value, required, nullable)
-        if self._value is not None:
-            self._validate()
-
-    def _validate(self):
-        if self._value not in range(3):
+    def validate(self, value):
+        if value not in range(3):
             raise ValueError("Некорректный пол")
+        return value
 
 
 class ClientIDsField(Field):
-    def __init__(self, value, required) -> None:
-        super().__init__(value, required, False)
-        self._validate()
+    def __init__(self, required=True) -> None:
+        super().__init__(required, nullable=False)
 
-    def _validate(self):
-        if isinstance(self.value, list):
-            if len(self.value) == 0:
+    def validate(self, value):
+        if isinstance(value, list):
+            if len(value) == 0:
                 raise ValueError("Массив не может быть пустым")
-            if not all(isinstance(i, int) for i in self.value):
+            if not all(isinstance(i, int) for i in value):
                 raise ValueError("Члены массива должны быть целым числов")
         else:
             raise ValueError("Поле должно быть массивом")
+        return value
+
+
+class RequestMeta(type):
+    """
+    Collects the Field declarations of a request class and compiles them into one validation function.
+    The declarations are replaced with __slots__, so request instances hold plain validated values.
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        declared = {key: value for key, value in namespace.items() if isinstance(value, Field)}
+        for key in declared:
+            del namespace[key]
+        namespace["__slots__"] = tuple(declared)
+        cls = super().__new__(mcs, name, bases, namespace)
+        fields = {}
+        for base in reversed(bases):
+            fields.update(getattr(base, "fields", {}))
+        fields.update(declared)
+        cls.fields = fields
+        cls.validate_fields = staticmethod(mcs.compile(fields, getattr(cls, "keys_required", False)))
+        return cls
+
+    @staticmethod
+    def compile(fields, keys_required):
+        cleaners = tuple((name, field.clean) for name, field in fields.items())
+        if keys_required:
+
+            def validate_fields(data):
+                return [(name, clean(data[name])) for name, clean in cleaners]
 
+        else:
+
+            def validate_fields(data):
+                get = data.get
+                return [(name, clean(get(name))) for name, clean in cleaners]
+
+        return validate_fields
+
+
+class Request(metaclass=RequestMeta):
+    keys_required = False  # Missing keys raise KeyError instead of being treated as None
+
+    def __init__(self, data) -> None:
+        if not isinstance(data, dict):
+            raise ValueError("Запрос должен быть объектом")
+        with metrics.stage("validate"):
+            for name, value in self.validate_fields(data):
+                setattr(self, name, value)
 
-class ClientsInterestsRequest:
-    def __init__(self, argument_dict) -> None:
-        self.client_ids = ClientIDsField(argument_dict.get("client_ids"), required=True)
-        self.date = DateField(argument_dict.get("date"), required=False, nullable=True)
+
+class ClientsInterestsRequest(Request):
+    client_ids = ClientIDsField(required=True)
+    date = DateField(required=False, nullable=True)
 
     def process(self, store):
-        output = {str(i): scoring.get_interests(store, i) for i in self.client_ids.value}
+        if STREAM_THRESHOLD and len(self.client_ids) > STREAM_THRESHOLD:
+            return InterestsStream(store, self.client_ids)
+        interests = scoring.get_interests_many(store, self.client_ids)
+        output = {str(i): value for i, value in interests.items()}
         return output
 
+    async def process_async(self, store):
+        interests = await scoring.get_interests_many_async(store, self.client_ids)
+        return {str(i): value for i, value in interests.items()}
+
+
+class InterestsStream:
+    """
+    clients_interests response that is read from the store and encoded batch by batch while it is sent.
+    A response that has started can't fail any more, so ids that are not found are listed in "missing" at the end.
+    """
+
+    def __init__(self, store, client_ids, batch_size=None):
+        self.store = store
+        self.client_ids = list(dict.fromkeys(client_ids))  # A repeated id would repeat a key of the object
+        self.batch_size = batch_size or STREAM_BATCH_SIZE
+        self.missing = []
+
+    def chunks(self, codec):
+        yield b'{"code": %d, "response": {' % OK
+        separator = b""
+        for interests in scoring.iter_interests(self.store, self.client_ids, self.batch_size):
+            found = {}
+            for cid, value in interests.items():
+                if value is None:
+                    self.missing.append(cid)
+                else:
+                    found[str(cid)] = value
+            if found:
+                yield separator + codec.dumps(found)[1:-1]
+                separator = b","
+        yield b'}, "missing": ' + codec.dumps(self.missing) + b"}"
+
+
+class OnlineScoreRequest(Request):
+    first_name = CharField(required=False, nullable=True)
+    last_name = CharField(required=False, nullable=True)
+    email = EmailField(required=False, nullable=True)
+    phone = PhoneField(required=False, nullable=True)
+    birthday = BirthDayField(required=False, nullable=True)
+    gender = GenderField(required=False, nullable=True)
 
-class OnlineScoreRequest:
     def __init__(self, argument_dict) -> None:
-        self.first_name = CharField(argument_dict.get("first_name"), required=False, nullable=True)
-        self.last_name = CharField(argument_dict.get("last_name"), required=False, nullable=True)
-        self.email = EmailField(argument_dict.get("email"), required=False, nullable=True)
-        self.phone = PhoneField(argument_dict.get("phone"), required=False, nullable=True)
-        self.birthday = BirthDayField(argument_dict.get("birthday"), required=False, nullable=True)
-        self.gender = GenderField(argument_dict.get("gender"), required=False, nullable=True)
+        super().__init__(argument_dict)
         if not self._validate():
             raise ValueError("Некорректный набор аргументов для метода online_score")
 
     def process(self, store):
         return scoring.get_score(
             store,
-            self.phone.value,
-            self.email.value,
-            self.birthday.value,
-            self.gender.value,
-            self.first_name.value,
-            self.last_name.value,
+            self.phone,
+            self.email,
+            self.birthday,
+            self.gender,
+            self.first_name,
+            self.last_name,
+        )
+
+    async def process_async(self, store):
+        return await scoring.get_score_async(
+            store,
+            self.phone,
+            self.email,
+            self.birthday,
+            self.gender,
+            self.first_name,
+            self.last_name,
         )
 
+    def score_arguments(self):
+        return {
+            "phone": self.phone,
+            "email": self.email,
+            "birthday": self.birthday,
+            "gender": self.gender,
+            "first_name": self.first_name,
+            "last_name": self.last_name,
+        }
+
     def _validate(self):
         valid_conditions = []
-        valid_conditions.append(all((self.phone.value, self.email.value)))
-        valid_conditions.append(all((self.first_name.value, self.last_name.value)))
-        valid_conditions.append(all((self.gender.value is not None, self.birthday.value)))
+        valid_conditions.append(all((self.phone, self.email)))
+        valid_conditions.append(all((self.first_name, self.last_name)))
+        valid_conditions.append(all((self.gender is not None, self.birthday)))
         return any(valid_conditions)
 
 
-class MethodRequest:
+class AuthCache:
+    """
+    Bounded LRU cache of verified credentials keyed by (account, login, token).
+    Admin tokens are cached until the end of the hour they were issued for, other tokens don't expire.
+    Only successful checks are cached, so the set of accepted requests stays the same.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> expiration timestamp
+        self._lock = threading.Lock()
+
+    def is_verified(self, key):
+        with self._lock:
+            expires_at = self._entries.get(key)
+            if expires_at is not None:
+                if expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True
+                del self._entries[key]
+            self.misses += 1
+        return False
+
+    def add(self, key, expires_at=float("inf")):
+        with self._lock:
+            self._entries[key] = expires_at
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+AUTH_CACHE = AuthCache()
+
+
+class MethodRequest(Request):
+    keys_required = True
+    account = CharField(required=False, nullable=True)
+    login = CharField(required=True, nullable=True)
+    token = CharField(required=True, nullable=True)
+    arguments = ArgumentsField(required=True, nullable=True)
+    method = CharField(required=True, nullable=False)
+
     def __init__(self, body_dict) -> None:
-        self.account = CharField(body_dict["account"], required=False, nullable=True)
-        self.login = CharField(body_dict["login"], required=True, nullable=True)
-        self.token = CharField(body_dict["token"], required=True, nullable=True)
-        self.arguments = ArgumentsField(body_dict["arguments"], required=True, nullable=True)
-        self.method = CharField(body_dict["method"], required=True, nullable=False)
-        if not self._check_auth():
+        super().__init__(body_dict)
+        with metrics.stage("auth"):
+            verified = self._check_auth()
+        if not verified:
             raise AccessError("Доступ запрещен")
 
     @property
     def is_admin(self):
-        return self.login.value == ADMIN_LOGIN
+        return self.login == ADMIN_LOGIN
 
     def process(self, ctx, store):
-        match self.method.value:
+        match self.method:
             case "online_score":
-                if self.login.value == "admin":
+                if self.login == "admin":
                     return {"score": 42}
-                out = {"score": OnlineScoreRequest(self.arguments.value).process(store)}
-                ctx["has"] = self.arguments.value.keys()
+                out = {"score": OnlineScoreRequest(self.arguments).process(store)}
+                ctx["has"] = self.arguments.keys()
                 return out
             case "clients_interests":
-                out = ClientsInterestsRequest(self.arguments.value).process(store)
-                ctx["nclients"] = len(self.arguments.value.get("client_ids"))
+                out = ClientsInterestsRequest(self.arguments).process(store)
+                ctx["nclients"] = len(self.arguments.get("client_ids"))
+                return out
+
+    async def process_async(self, ctx, store):
+        match self.method:
+            case "online_score":
+                if self.login == "admin":
+                    return {"score": 42}
+                out = {"score": await OnlineScoreRequest(self.arguments).process_async(store)}
+                ctx["has"] = self.arguments.keys()
+                return out
+            case "clients_interests":
+                out = await ClientsInterestsRequest(self.arguments).process_async(store)
+                ctx["nclients"] = len(self.arguments.get("client_ids"))
                 return out
 
     def _check_auth(self):
+        key = (self.account, self.login, self.token)
+        if AUTH_CACHE.is_verified(key):
+            return True
         if self.is_admin:
-            digest = hashlib.sha512(
-                (datetime.datetime.today().strftime("%Y%m%d%H") + ADMIN_SALT).encode("utf-8")
-            ).hexdigest()
+            now = datetime.datetime.today()
+            digest = hashlib.sha512((now.strftime("%Y%m%d%H") + ADMIN_SALT).encode("utf-8")).hexdigest()
+            expires_at = (now.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)).timestamp()
         else:
-            digest = hashlib.sha512((self.account.value + self.login.value + SALT).encode("utf-8")).hexdigest()
-        return digest == self.token.value
+            digest = hashlib.sha512((self.account + self.login + SALT).encode("utf-8")).hexdigest()
+            expires_at = float("inf")
+        if not hmac.compare_digest(digest.encode("utf-8"), self.token.encode("utf-8")):
+            return False
+        AUTH_CACHE.add(key, expires_at)
+        return True
 
 
 def method_handler(request, ctx, store):
@@ -229,54 +444,184 @@ def method_handler(request, ctx, store):
 
         response, code = request.process(ctx, store), OK
         return response, code
-    except ValueError as e:
-        logging.exception(e)
-        return {"code": INVALID_REQUEST}, INVALID_REQUEST
-    except KeyError as e:
-        logging.exception(e)
+    except (ValueError, KeyError, AccessError) as e:
+        return error_response(e)
+
+
+async def method_handler_async(request, ctx, store):
+    try:
+        request = MethodRequest(request.get("body"))
+        return await request.process_async(ctx, store), OK
+    except (ValueError, KeyError, AccessError) as e:
+        return error_response(e)
+
+
+def batch_handler(request, ctx, store):
+    """
+    Handle a list of method requests. Credentials are checked through AUTH_CACHE,
+    cached scores and interests for all items are read in one bulk call each.
+    """
+    items = request.get("body")
+    if not isinstance(items, list):
         return {"code": INVALID_REQUEST}, INVALID_REQUEST
-    except AccessError as e:
-        logging.exception(e)
-        return {"code": FORBIDDEN}, FORBIDDEN
+    ctx["nrequests"] = len(items)
+    results = [None] * len(items)
+    score_requests, interests_requests = [], []
+    for i, item in enumerate(items):
+        try:
+            method_request = MethodRequest(item)
+            match method_request.method:
+                case "online_score" if not method_request.is_admin:
+                    score_requests.append((i, OnlineScoreRequest(method_request.arguments)))
+                case "clients_interests":
+                    interests_requests.append((i, ClientsInterestsRequest(method_request.arguments)))
+                case _:
+                    results[i] = method_request.process({}, store), OK
+        except (ValueError, KeyError, AccessError) as e:
+            results[i] = error_response(e)
+        except TypeError as e:
+            results[i] = error_response(ValueError(e))
+
+    if score_requests:
+        scores = scoring.get_scores(store, [r.score_arguments() for _, r in score_requests])
+        for (i, _), score in zip(score_requests, scores):
+            results[i] = {"score": score}, OK
+    if interests_requests:
+        cids = list(dict.fromkeys(cid for _, r in interests_requests for cid in r.client_ids))
+        interests = scoring.find_interests(store, cids)
+        for i, r in interests_requests:
+            missing = [cid for cid in r.client_ids if interests[cid] is None]
+            if missing:
+                results[i] = error_response(KeyError(f"Values with keys {missing} don't exist in cache"))
+            else:
+                results[i] = {str(cid): interests[cid] for cid in r.client_ids}, OK
+
+    return [build_response(response, code) for response, code in results], OK
+
+
+def error_response(e):
+    # Rejected requests are routine, the context log record has their code; no traceback needed
+    logging.debug("Request rejected: %r", e)
+    code = FORBIDDEN if isinstance(e, AccessError) else INVALID_REQUEST
+    return {"code": code}, code
+
+
+def metrics_label(path, request, router):
+    # Known routes and methods only, so clients can't create new metric series
+    if path == "method" and isinstance(request, dict) and request.get("method") in METHODS:
+        return request["method"]
+    return path if path in router else "other"
+
+
+def build_response(response, code):
+    if code not in ERRORS:
+        return {"response": response, "code": code}
+    return {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
 
 
 class MainHTTPHandler(BaseHTTPRequestHandler):
-    router = {"method": method_handler}
-    store = store.RedisStore()
+    router = {"method": method_handler, "batch": batch_handler}
+    store = None  # Set by runserver.init_worker, a Redis connection is opened only when configured
+    codec = jsoncodec.CODEC  # Request and response bodies, see jsoncodec.get_codec
+    protocol_version = "HTTP/1.1"  # Keep connections open between requests
+    timeout = 30  # Close idle keep-alive connections
+    disable_nagle_algorithm = True  # Headers and body are separate writes, don't delay the body
+
+    def log_message(self, format, *args):
+        # Access lines go through logging instead of a direct write to stderr, the context record covers them
+        logging.debug("%s - %s", self.address_string(), format % args)
 
     def get_request_id(self, headers):
         return headers.get("HTTP_X_REQUEST_ID", uuid.uuid4().hex)
 
     def do_POST(self):
+        started = time.perf_counter()
+        timings = metrics.start_request()
         response, code = {}, OK
         context = {"request_id": self.get_request_id(self.headers)}
+        path = self.path.strip("/")
         request = None
         try:
-            data_string = self.rfile.read(int(self.headers["Content-Length"]))
-            request = json.loads(data_string)
+            with metrics.stage("read"):
+                data_string = self.read_body(int(self.headers["Content-Length"]))
+            with metrics.stage("parse"):
+                request = self.codec.loads(data_string)
         except Exception:
             code = BAD_REQUEST
+            self.close_connection = True
 
         if request:
-            path = self.path.strip("/")
-            logging.info("%s: %s %s" % (self.path, data_string, context["request_id"]))
+            logging.debug("%s: %s %s", self.path, data_string, context["request_id"])
             if path in self.router:
                 try:
                     response, code = self.router[path]({"body": request, "headers": self.headers}, context, self.store)
                 except Exception as e:
-                    logging.exception("Unexpected error: %s" % e)
+                    logging.exception("Unexpected error: %s", e)
                     code = INTERNAL_ERROR
             else:
                 code = NOT_FOUND
 
+        payload = None
+        if isinstance(response, InterestsStream):
+            try:
+                with metrics.stage("stream"):
+                    self.send_stream(code, response.chunks(self.codec))
+            except Exception as e:
+                # The status line is already sent, an unfinished body tells the client the response is incomplete
+                logging.exception("Unexpected error: %s", e)
+                code, self.close_connection = INTERNAL_ERROR, True
+            context.update(code=code, nmissing=len(response.missing))
+        else:
+            r = build_response(response, code)
+            context.update(r)
+            with metrics.stage("encode"):
+                payload = self.codec.dumps(r)
+        if timings is not None:
+            label = metrics_label(path, request, self.router)
+            context["timings"] = metrics.finish_request(timings, label, code, time.perf_counter() - started)
+        logging.info(context, extra={"sampled": code < BAD_REQUEST})
+        if payload is not None:
+            self.send_payload(code, payload)
+        return
+
+    def do_GET(self):
+        if self.path.strip("/") == "metrics" and metrics.ENABLED:
+            self.send_payload(OK, metrics.REGISTRY.render().encode("utf-8"), metrics.CONTENT_TYPE)
+        else:
+            self.send_payload(NOT_FOUND, self.codec.dumps(build_response({}, NOT_FOUND)))
+
+    def read_body(self, length):
+        # Fill one buffer of the announced size, the codec parses it as is
+        body = bytearray(length)
+        view = memoryview(body)
+        received = 0
+        while received < length:
+            size = self.rfile.readinto(view[received:])
+            if not size:
+                raise ConnectionError("Request body is shorter than Content-Length")
+            received += size
+        return body
+
+    def send_payload(self, code, payload, content_type="application/json"):
+        # The encoded body is written as is, with TCP_NODELAY it isn't held back behind the headers
         self.send_response(code)
-        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
         self.end_headers()
-        if code not in ERRORS:
-            r = {"response": response, "code": code}
+        self.wfile.write(payload)
+
+    def send_stream(self, code, chunks, content_type="application/json"):
+        # The length is not known up front, every chunk is written as soon as it is ready: with chunked transfer
+        # encoding over HTTP/1.1, HTTP/1.0 has no chunks and the end of the body is the end of the connection
+        chunked = self.protocol_version == "HTTP/1.1" and self.request_version == "HTTP/1.1"
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
         else:
-            r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
-        context.update(r)
-        logging.info(context)
-        self.wfile.write(json.dumps(r).encode("utf-8"))
-        return
+            self.send_header("Connection", "close")
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk) if chunked else chunk)
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
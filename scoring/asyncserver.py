@@ -0,0 +1,107 @@
+﻿import asyncio
+import logging
+import time
+import uuid
+from http import HTTPStatus
+
+from scoring import api, jsoncodec, metrics
+
+MAX_HEADER_SIZE = 64 * 1024
+
+router = {"method": api.method_handler_async}
+codec = jsoncodec.CODEC
+
+
+async def handle_request(method, path, headers, body, store):
+    """
+    Same request handling as MainHTTPHandler.do_POST, for the asyncio server.
+    """
+    started = time.perf_counter()
+    timings = metrics.start_request()
+    response, code = {}, api.OK
+    context = {"request_id": headers.get("x-request-id", uuid.uuid4().hex)}
+    path = path.strip("/")
+    request = None
+    if method != "POST":
+        code = api.METHOD_NOT_ALLOWED
+    else:
+        try:
+            with metrics.stage("parse"):
+                request = codec.loads(body)
+        except Exception:
+            code = api.BAD_REQUEST
+
+    if request:
+        logging.debug("%s: %s %s", path, body, context["request_id"])
+        if path in router:
+            try:
+                response, code = await router[path]({"body": request, "headers": headers}, context, store)
+            except Exception as e:
+                logging.exception("Unexpected error: %s", e)
+                code = api.INTERNAL_ERROR
+        else:
+            code = api.NOT_FOUND
+
+    r = api.build_response(response, code)
+    context.update(r)
+    with metrics.stage("encode"):
+        payload = codec.dumps(r)
+    if timings is not None:
+        label = api.metrics_label(path, request, router)
+        context["timings"] = metrics.finish_request(timings, label, code, time.perf_counter() - started)
+    logging.info(context, extra={"sampled": code < api.BAD_REQUEST})
+    return code, payload
+
+
+async def handle_connection(reader, writer, store):
+    """
+    Serve HTTP/1.1 requests from one connection until the client closes it or asks to.
+    """
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                break
+            request_line, *header_lines = head.decode("latin-1").split("\r\n")
+            try:
+                method, path, version = request_line.split(" ", 2)
+            except ValueError:
+                break
+            headers = {}
+            for line in header_lines:
+                if line:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+            try:
+                body = await reader.readexactly(int(headers.get("content-length") or 0))
+            except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+                break
+
+            content_type = "application/json"
+            if method == "GET" and path.strip("/") == "metrics" and metrics.ENABLED:
+                code, payload, content_type = api.OK, metrics.REGISTRY.render().encode("utf-8"), metrics.CONTENT_TYPE
+            else:
+                code, payload = await handle_request(method, path, headers, body, store)
+            connection = headers.get("connection", "").lower()
+            keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+            head = (
+                f"HTTP/1.1 {code} {HTTPStatus(code).phrase}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+            )
+            writer.writelines((head.encode("latin-1"), payload))
+            await writer.drain()
+            if not keep_alive:
+                break
+    finally:
+        writer.close()
+
+
+async def serve(host, port, store):
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(reader, writer, store), host, port, limit=MAX_HEADER_SIZE
+    )
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,48 @@
+import hashlib
+import math
+import struct
+
+_HEADER = struct.Struct("<QB")  # Number of bits, number of hash functions
+
+
+class BloomFilter:
+    """
+    Set membership with false positives and no false negatives: a key that was added is always found,
+    a key that was not is found with a probability close to the `error_rate` the filter was sized for.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        capacity = max(capacity, 1)
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def to_bytes(self) -> bytes:
+        return _HEADER.pack(self.num_bits, self.num_hashes) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "BloomFilter":
+        bloom = cls.__new__(cls)
+        bloom.num_bits, bloom.num_hashes = _HEADER.unpack_from(data)
+        header_size = _HEADER.size
+        bloom.bits = bytearray(data[header_size:])
+        if len(bloom.bits) != (bloom.num_bits + 7) // 8:
+            raise ValueError("Truncated bloom filter")
+        return bloom
+
+    def _positions(self, key):
+        # Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(str(key).encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
@@ -0,0 +1,67 @@
+from argparse import BooleanOptionalAction
+
+from scoring import store
+
+# Sharded Redis is selected by --redis-nodes, it needs node addresses that --store can't give
+STORE_CHOICES = tuple(name for name in store.BACKENDS if name != "sharded")
+
+
+def add_store_arguments(parser, redis_only=False):
+    """
+    Add the options build_store reads. With `redis_only` only the Redis addresses are added,
+    for scripts that write to the primary: build_store then needs the other settings as overrides.
+    """
+    if not redis_only:
+        parser.add_argument("--store", action="store", choices=STORE_CHOICES, default="redis")
+    parser.add_argument("--redis-host", action="store", default="localhost")
+    parser.add_argument("--redis-port", action="store", type=int, default=6379)
+    parser.add_argument(
+        "--redis-nodes", action="store", default="", help="comma-separated host:port list, shards keys across them"
+    )
+    if redis_only:
+        return
+    parser.add_argument(
+        "--redis-replicas", action="store", default="", help="comma-separated host:port list of read replicas"
+    )
+    parser.add_argument(
+        "--value-format", action="store", choices=tuple(store.VALUE_FORMATS), default="binary", help="for new values"
+    )
+    parser.add_argument(
+        "--legacy-pickle", action=BooleanOptionalAction, default=False, help="read pickled values of older versions"
+    )
+    parser.add_argument(
+        "--local-cache-mb", action="store", type=int, default=0, help="in-process cache size, 0 disables"
+    )
+
+
+def check_store_arguments(parser, args):
+    """
+    Exit with a usage error for store options that can't work together.
+    """
+    if args.value_format == "pickle" and not args.legacy_pickle:
+        parser.error("--value-format pickle requires --legacy-pickle to read the values back")
+
+
+def build_store(args, backend=None, **overrides):
+    """
+    Build the store the parsed options select, `overrides` replace or supply settings by option name,
+    e.g. build_store(args, local_cache_mb=0). Redis connections are opened per process, so a `backend` created
+    once before forking workers is passed in and only wrapped.
+    """
+    settings = {**vars(args), **overrides}
+    handler_store = backend
+    if handler_store is None:
+        options = {"codec": store.VALUE_FORMATS[settings["value_format"]], "legacy_pickle": settings["legacy_pickle"]}
+    if handler_store is None and settings["redis_nodes"]:
+        handler_store = store.create_store("sharded", addresses=settings["redis_nodes"].split(","), **options)
+    elif handler_store is None:
+        handler_store = store.create_store("redis", host=settings["redis_host"], port=settings["redis_port"], **options)
+        if settings["redis_replicas"]:
+            replicas = []
+            for address in settings["redis_replicas"].split(","):
+                host, port = address.rsplit(":", 1)
+                replicas.append(store.create_store("redis", host=host, port=int(port), **options))
+            handler_store = store.ReplicatedStore(handler_store, replicas)
+    if settings["local_cache_mb"]:
+        handler_store = store.LocalCacheStore(handler_store, max_bytes=settings["local_cache_mb"] * 1024 * 1024)
+    return handler_store
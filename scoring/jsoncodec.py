@@ -0,0 +1,52 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # Optional: pip install orjson
+    orjson = None
+
+
+class StdlibJsonCodec:
+    """
+    Request and response bodies through the json module.
+    """
+
+    name = "stdlib"
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumps(self, value) -> bytes:
+        return json.dumps(value).encode("utf-8")
+
+
+class OrjsonCodec:
+    """
+    Request and response bodies through orjson: it parses bytes-like buffers directly and serializes
+    straight to UTF-8 bytes, without the intermediate str json.dumps makes.
+    """
+
+    name = "orjson"
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def dumps(self, value) -> bytes:
+        return orjson.dumps(value)
+
+
+CODECS = {StdlibJsonCodec.name: StdlibJsonCodec()}
+if orjson is not None:
+    CODECS[OrjsonCodec.name] = OrjsonCodec()
+CODEC = CODECS.get(OrjsonCodec.name) or CODECS[StdlibJsonCodec.name]  # The fastest installed one
+
+
+def get_codec(name=None):
+    """
+    Codec by name, the fastest installed one when the name is not given.
+    """
+    if name is None:
+        return CODEC
+    if name not in CODECS:
+        raise ValueError(f"JSON codec {name!r} is not available, installed: {', '.join(CODECS)}")
+    return CODECS[name]
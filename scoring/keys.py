@@ -0,0 +1,34 @@
+import hashlib
+import struct
+
+# Score keys are the prefix and a 16-byte BLAKE2b digest of the canonical fields: 18 bytes per key
+# instead of the 36 of the legacy "uid:" + MD5 hex keys
+SCORE_PREFIX = b"s:"
+SCORE_DIGEST_SIZE = 16
+# Migration mode: scores missing under the new keys are also looked up under the legacy keys,
+# which servers of older versions keep writing. Legacy keys expire with the score cache, so the mode
+# is needed for one cache duration after the last old server is gone.
+READ_LEGACY_KEYS = False
+
+_lengths = struct.Struct("<4I").pack
+_blake2b = hashlib.blake2b
+
+
+def score_key(phone, birthday, first_name, last_name) -> bytes:
+    """
+    Binary cache key of a score. The digested bytes are the UTF-8 lengths of first name, last name, phone
+    and birthday as four uint32 followed by their UTF-8, so different field values never give the same bytes.
+    None is encoded like "".
+    """
+    a = first_name.encode("utf-8") if first_name else b""
+    b = last_name.encode("utf-8") if last_name else b""
+    c = phone.encode("utf-8") if phone else b""
+    d = birthday.encode("utf-8") if birthday else b""
+    digest = _blake2b(_lengths(len(a), len(b), len(c), len(d)) + a + b + c + d, digest_size=SCORE_DIGEST_SIZE)
+    return SCORE_PREFIX + digest.digest()
+
+
+def legacy_score_key(phone, birthday, first_name, last_name) -> str:
+    # Fields joined without a separator: "ab" + "c" and "a" + "bc" share a key
+    key_parts = [first_name or "", last_name or "", phone or "", birthday or ""]
+    return "uid:" + hashlib.md5("".join(key_parts).encode("utf-8")).hexdigest()
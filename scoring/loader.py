@@ -0,0 +1,72 @@
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from scoring import scoring
+from scoring.bloom import BloomFilter
+
+MAX_VOCABULARY = 1 << 16  # Interest ids are stored as uint16
+
+
+def load_interests(
+    store, records, version=None, batch_size=1000, workers=4, ttl=None, pause=0.0, packed=True, bloom_error_rate=None
+):
+    """
+    Write (cid, interests) records under a new version prefix i:<version>:, then point readers to it.
+    Batches of `batch_size` keys are written with one pipelined set_many each, `workers` batches at a time,
+    sleeping `pause` seconds between batches to keep the load on the store even.
+    The pointer is switched only after every batch was written, so readers see either the whole old dataset
+    or the whole new one. The loaded keys don't expire; once the pointer is switched, keys of the version it
+    pointed to before expire in `ttl` seconds (None keeps them).
+    With `packed` every client's interests are stored as ids into a vocabulary written with the version,
+    otherwise as lists of names. With `bloom_error_rate` a Bloom filter of the loaded ids is written with
+    the version, so readers reject most ids that are not loaded without a store read.
+    Returns (version, number of records).
+    """
+    version = version or time.strftime("%Y%m%d%H%M%S")
+    prefix = scoring.interests_prefix(version)
+    records = iter(records)
+    loaded = 0
+    vocabulary = {}  # interest -> id
+    cids = []  # Loaded ids, the filter is sized for their number
+
+    def encode(interests):
+        if not packed or not interests:
+            return interests
+        ids = [vocabulary.setdefault(interest, len(vocabulary)) for interest in interests]
+        if len(vocabulary) > MAX_VOCABULARY:
+            raise ValueError(f"More than {MAX_VOCABULARY} distinct interests")
+        return scoring.pack_interests(ids)
+
+    with ThreadPoolExecutor(workers) as pool:
+        pending = deque()
+        while chunk := list(islice(records, batch_size)):
+            batch = [(f"{prefix}{cid}", encode(interests)) for cid, interests in chunk]
+            if bloom_error_rate:
+                cids.extend(cid for cid, _ in chunk)
+            pending.append(pool.submit(store.set_many, batch, None))
+            loaded += len(batch)
+            if len(pending) >= workers:
+                pending.popleft().result()
+            if pause:
+                time.sleep(pause)
+        while pending:
+            pending.popleft().result()
+    if vocabulary:
+        store.set_many([(f"{prefix}{scoring.INTERESTS_VOCABULARY}", list(vocabulary))], None)
+    if bloom_error_rate:
+        bloom = BloomFilter(len(cids), bloom_error_rate)
+        for cid in cids:
+            bloom.add(cid)
+        store.set_many([(f"{prefix}{scoring.INTERESTS_BLOOM}", bloom.to_bytes())], None)
+    previous = store.get(scoring.INTERESTS_POINTER)
+    previous = previous.decode("utf-8") if isinstance(previous, bytes) else previous
+    store.set_many([(scoring.INTERESTS_POINTER, version)], None)
+    if ttl is not None and previous and previous != version:
+        # Unversioned i:<cid> keys (no previous pointer) share the prefix of every version and are kept
+        expired = store.expire_prefix(scoring.interests_prefix(previous), ttl)
+        logging.info("%d keys of version %s expire in %ss", expired, previous, ttl)
+    logging.info("Loaded %d clients' interests as version %s", loaded, version)
+    return version, loaded
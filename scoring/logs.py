@@ -0,0 +1,163 @@
+import collections.abc
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from logging.handlers import QueueHandler
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Puts records on a bounded queue without blocking: when the queue is full the record is dropped and counted.
+    Records are formatted later in the listener thread, so logged arguments must not be changed afterwards.
+    """
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+        self.listener = None
+
+    def close(self):
+        # logging.shutdown() closes handlers at exit, queued records are written out before that
+        if self.listener is not None:
+            self.listener.stop()
+        super().close()
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a `rate` share of the records logged with extra={"sampled": True}, all other records pass.
+    """
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return self.rate >= 1.0 or not getattr(record, "sampled", False) or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record. Fields of a dict message go to the top level of the object.
+    """
+
+    def format(self, record):
+        entry = {"time": self.formatTime(record, self.datefmt), "level": record.levelname, "logger": record.name}
+        if isinstance(record.msg, dict):
+            entry.update(record.msg)
+        else:
+            entry["message"] = record.getMessage()
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=_json_default)
+
+
+class BatchingListener:
+    """
+    Background thread that takes records off the queue and writes up to `batch_size` of them with one write.
+    """
+
+    def __init__(self, queue, handler, stream, formatter, batch_size=256):
+        self.queue = queue
+        self.handler = handler
+        self.stream = stream
+        self.formatter = formatter
+        self.batch_size = batch_size
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="log-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # The None sentinel makes the thread write out what is queued and exit
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join()
+        self._thread = None
+
+    def restart_after_fork(self):
+        # Threads don't survive fork and the queue lock may be held by one, the child starts over
+        self.queue = self.handler.queue = queue.Queue(self.queue.maxsize)
+        self.handler.dropped = 0
+        self.start()
+
+    def _run(self):
+        while True:
+            records = [self.queue.get()]
+            while records[-1] is not None and len(records) < self.batch_size:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write([record for record in records if record is not None])
+            if records[-1] is None:
+                return
+
+    def _write(self, records):
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.formatter.format(record))
+            except Exception:
+                lines.append(f"Failed to format log record {record.msg!r}")
+        if self.handler.dropped:
+            dropped, self.handler.dropped = self.handler.dropped, 0
+            lines.append(self.formatter.format(_dropped_record(dropped)))
+        if lines:
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
+
+
+def setup_logging(
+    level=logging.INFO, filename=None, json_format=False, queue_size=10000, sample_rate=1.0, batch_size=256
+):
+    """
+    Route the root logger through a bounded queue to a background thread that writes records in batches.
+    Request threads never wait for log I/O: when the queue is full records are dropped and later reported.
+    Returns the listener; logging.shutdown(), which runs at exit, writes out the queue and stops it.
+    """
+    stream = open(filename, "a", encoding="utf-8") if filename else sys.stderr
+    if json_format:
+        formatter = JsonFormatter(datefmt="%Y-%m-%dT%H:%M:%S")
+    else:
+        formatter = logging.Formatter("[%(asctime)s] %(levelname).1s %(message)s", datefmt="%Y.%m.%d %H:%M:%S")
+    handler = DroppingQueueHandler(queue.Queue(queue_size))
+    handler.addFilter(SamplingFilter(sample_rate))
+    # Neither format shows caller, thread or process, skip collecting them (see "Optimization" in the logging HOWTO)
+    logging._srcfile = None
+    logging.logThreads = logging.logProcesses = logging.logMultiprocessing = False
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    handler.listener = BatchingListener(handler.queue, handler, stream, formatter, batch_size)
+    handler.listener.start()
+    os.register_at_fork(after_in_child=handler.listener.restart_after_fork)
+    return handler.listener
+
+
+def _dropped_record(count):
+    return logging.LogRecord("scoring.logs", logging.WARNING, __file__, 0, "%d log records dropped", (count,), None)
+
+
+def _json_default(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    if isinstance(value, collections.abc.Iterable):
+        return list(value)
+    return str(value)
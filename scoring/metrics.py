@@ -0,0 +1,158 @@
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+
+ENABLED = False  # Set before serving requests, nothing is measured while it is off
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_timings = contextvars.ContextVar("timings", default=None)  # Stage durations of the request being served
+_NOOP = contextlib.nullcontext()
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}  # label values -> count
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # label values -> [count per bucket and +Inf, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = _format_labels(self.labels + ("le",), labels + (str(bound),))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labels=()):
+        self.metrics.append(Counter(name, help, labels))
+        return self.metrics[-1]
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.metrics.append(Histogram(name, help, labels, buckets))
+        return self.metrics[-1]
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        return "".join(line + "\n" for metric in self.metrics for line in metric.render())
+
+
+REGISTRY = Registry()
+REQUESTS = REGISTRY.counter("scoring_requests_total", "Handled requests", ("method", "code"))
+REQUEST_SECONDS = REGISTRY.histogram("scoring_request_duration_seconds", "Request handling time", ("method",))
+STAGE_SECONDS = REGISTRY.histogram("scoring_stage_duration_seconds", "Time spent in request stages", ("stage",))
+STORE_SECONDS = REGISTRY.histogram("scoring_store_duration_seconds", "Store round trips", ("operation",))
+STORE_ERRORS = REGISTRY.counter("scoring_store_errors_total", "Failed store round trips", ("operation",))
+
+
+class _Stage:
+    __slots__ = ("name", "histogram", "start")
+
+    def __init__(self, name, histogram):
+        self.name = name
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        self.histogram.observe(elapsed, self.name)
+        timings = _timings.get()
+        if timings is not None:
+            key = "store" if self.histogram is STORE_SECONDS else self.name
+            timings[key] = timings.get(key, 0.0) + elapsed
+        if exc_type is not None and self.histogram is STORE_SECONDS:
+            STORE_ERRORS.inc(self.name)
+
+
+def stage(name):
+    """
+    Time a request stage: `with metrics.stage("auth"): ...`. Does nothing while metrics are off.
+    """
+    return _Stage(name, STAGE_SECONDS) if ENABLED else _NOOP
+
+
+def store_operation(name):
+    """
+    Time a store round trip, it is added to the "store" stage of the current request.
+    """
+    return _Stage(name, STORE_SECONDS) if ENABLED else _NOOP
+
+
+def start_request():
+    """
+    Start collecting stage timings for the request served in the current thread or task.
+    Returns the timings dict, or None while metrics are off.
+    """
+    if not ENABLED:
+        return None
+    timings = {}
+    _timings.set(timings)
+    return timings
+
+
+def finish_request(timings, method, code, elapsed):
+    """
+    Count the request and return its stage timings in milliseconds for the log record.
+    """
+    _timings.set(None)
+    REQUESTS.inc(method, str(code))
+    REQUEST_SECONDS.observe(elapsed, method)
+    return {name: round(seconds * 1000, 3) for name, seconds in timings.items()}
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -1,9 +1,46 @@
-﻿import hashlib
+﻿import array
 import json
 import logging
+import math
+import random
+import sys
+import time
+import weakref
 from typing import Optional
 
+from scoring import keys as score_keys
 from scoring import store
+from scoring.bloom import BloomFilter
+from scoring.singleflight import SingleFlight
+
+SCORE_CACHE_DURATION = 60 * 60
+# Probabilistic early refresh (XFetch): a cached score is recomputed before it expires with a probability
+# that grows as the expiry approaches; larger values refresh earlier, 0 disables it
+EARLY_REFRESH_BETA = 0.0
+
+# Concurrent misses for the same score key wait for one computation instead of repeating it
+score_flights = SingleFlight()
+_compute_time = 0.0  # Moving average of the compute-and-cache time in seconds
+
+# Interests are kept under i:<version>:<cid>, the version in use is stored in the pointer key.
+# Without a pointer the unversioned i:<cid> keys are read.
+INTERESTS_POINTER = "i:current"
+INTERESTS_PREFIX_TTL = 5.0  # Seconds a process keeps using a resolved prefix
+_interests_prefixes = weakref.WeakKeyDictionary()  # store -> (prefix, expires_at)
+# Loaded versions store every client's interests as uint16 ids into a list of interest names
+# kept under i:<version>:vocab; the ids follow this marker byte, which never starts a JSON document
+INTERESTS_VOCABULARY = "vocab"
+PACKED_INTERESTS = b"\x00"
+_vocabularies = weakref.WeakKeyDictionary()  # store -> (prefix, vocabulary) of the last version read
+# The loader may add a Bloom filter of the version's client ids under i:<version>:bloom,
+# ids it rejects are known to be missing without a store read
+INTERESTS_BLOOM = "bloom"
+_blooms = weakref.WeakKeyDictionary()  # store -> (prefix, filter or None) of the last version read
+# Keys found missing are not read again for NEGATIVE_CACHE_TTL seconds, 0 disables it.
+# The keys include the version, so a newly loaded version starts without negative entries.
+NEGATIVE_CACHE_TTL = 5.0
+NEGATIVE_CACHE_SIZE = 100000  # Keys per store, the cache is emptied when it would grow larger
+_negative_caches = weakref.WeakKeyDictionary()  # store -> {key: expires_at}
 
 
 def get_score(
@@ -15,20 +52,159 @@ def get_score(
     first_name: Optional[str] = None,
     last_name: Optional[str] = None,
 ) -> float:
-    key_parts = [
-        first_name or "",
-        last_name or "",
-        phone or "",
-        birthday or "",
-    ]
-    key = "uid:" + hashlib.md5("".join(key_parts).encode("utf-8")).hexdigest()
+    key = score_keys.score_key(phone, birthday, first_name, last_name)
 
     # Try to get from cache
-    score = store.cache_get(key)
+    if EARLY_REFRESH_BETA:
+        score, ttl = store.cache_get_with_ttl(key)
+        if score is not None and not _refresh_early(ttl):
+            return float(score)
+    else:
+        score = store.cache_get(key)
+        if score is not None:
+            return float(score)
+    if score is None and score_keys.READ_LEGACY_KEYS:
+        score = store.cache_get(score_keys.legacy_score_key(phone, birthday, first_name, last_name))
+        if score is not None:
+            return float(score)
+
+    return score_flights.do(key, _compute_and_cache, store, key, phone, email, birthday, gender, first_name, last_name)
+
+
+async def get_score_async(
+    store: store.AsyncStore,
+    phone: Optional[str] = None,
+    email: Optional[str] = None,
+    birthday: Optional[str] = None,
+    gender: Optional[int] = None,
+    first_name: Optional[str] = None,
+    last_name: Optional[str] = None,
+) -> float:
+    key = score_keys.score_key(phone, birthday, first_name, last_name)
+    score = await store.cache_get(key)
+    if score is None and score_keys.READ_LEGACY_KEYS:
+        score = await store.cache_get(score_keys.legacy_score_key(phone, birthday, first_name, last_name))
     if score is not None:
         return float(score)
+    score = _compute_score(phone, email, birthday, gender, first_name, last_name)
+    await store.cache_set(key, score, SCORE_CACHE_DURATION)
+    return score
+
+
+def get_scores(store: store.Store, people: list) -> list:
+    """
+    Score several people with one bulk cache read.
+    Every item is a dict with the get_score keyword arguments.
+    """
+    rows = [
+        (person.get("phone"), person.get("birthday"), person.get("first_name"), person.get("last_name"))
+        for person in people
+    ]
+    keys = [score_keys.score_key(*row) for row in rows]
+    scores, computed = [], []
+    for key, person, score in zip(keys, people, _with_legacy_scores(store, rows, store.cache_get_many(keys))):
+        if score is None:
+            score = _compute_score(**person)
+            computed.append((key, score))
+        scores.append(float(score))
+    if computed:
+        store.cache_set_many(computed, SCORE_CACHE_DURATION)
+    return scores
+
+
+def get_scores_batch(
+    store: store.Store,
+    phone=None,
+    email=None,
+    birthday=None,
+    gender=None,
+    first_name=None,
+    last_name=None,
+    chunk_size: int = 10000,
+):
+    """
+    Score people given as columns: equal-length sequences or NumPy arrays, missing values are None or "".
+    Phones may be numbers, like PhoneField accepts them. Omitted columns are treated as all missing.
+    Rows are processed in chunks of `chunk_size` with one bulk cache read and one bulk cache write per chunk.
+    Cache keys are still hashed row by row, which bounds the speedup over get_score.
+    Returns a float64 NumPy array with the same scores get_score gives for every row.
+    Requires NumPy, which is not a dependency of the server: `pip install numpy`.
+    """
+    import numpy as np
+
+    columns = [phone, email, birthday, gender, first_name, last_name]
+    lengths = {len(column) for column in columns if column is not None}
+    if len(lengths) > 1:
+        raise ValueError(f"Columns must have equal lengths, got {sorted(lengths)}")
+    size = lengths.pop() if lengths else 0
+    columns = [[None] * size if column is None else column for column in columns]
+    scores = np.empty(size)
+    for start in range(0, size, chunk_size):
+        end = min(start + chunk_size, size)
+        scores[start:end] = _score_chunk(np, store, *(column[start:end] for column in columns))
+    return scores
+
+
+def _score_chunk(np, store, phone, email, birthday, gender, first_name, last_name):
+    phone = [str(value) if value else value for value in phone]  # Keys are built from the phone as PhoneField gives it
+    rows = list(zip(phone, birthday, first_name, last_name))
+    keys = list(map(score_keys.score_key, phone, birthday, first_name, last_name))
+    cached = _with_legacy_scores(store, rows, store.cache_get_many(keys))
+    scores = np.fromiter((np.nan if score is None else float(score) for score in cached), dtype=float, count=len(keys))
+    missing = np.flatnonzero(np.isnan(scores))
+    if len(missing):
+        has_gender = np.fromiter((value is not None for value in gender), dtype=bool, count=len(keys))
+        # Same additions in the same order as _compute_score, so the floats are identical
+        computed = np.zeros(len(keys))
+        computed += np.where(_present(np, phone), 1.5, 0.0)
+        computed += np.where(_present(np, email), 1.5, 0.0)
+        computed += np.where(_present(np, birthday) & has_gender, 1.5, 0.0)
+        computed += np.where(_present(np, first_name) & _present(np, last_name), 0.5, 0.0)
+        # Like consecutive get_score calls, a repeated key gets the score computed for its first row
+        first = {}
+        for i in missing:
+            first.setdefault(keys[i], i)
+        scores[missing] = computed[[first[keys[i]] for i in missing]]
+        store.cache_set_many([(key, float(computed[i])) for key, i in first.items()], SCORE_CACHE_DURATION)
+    return scores
+
+
+def _compute_and_cache(store, key, phone, email, birthday, gender, first_name, last_name) -> float:
+    global _compute_time
+    start = time.perf_counter()
+    score = _compute_score(phone, email, birthday, gender, first_name, last_name)
+
+    # Cache the score for 60 minutes
+    store.cache_set(key, score, SCORE_CACHE_DURATION)
+    _compute_time += 0.2 * (time.perf_counter() - start - _compute_time)
+    return score
+
+
+def _refresh_early(ttl) -> bool:
+    # XFetch: refresh when compute_time * beta * -log(rand) reaches the remaining lifetime
+    if ttl is None:
+        return False
+    return -_compute_time * EARLY_REFRESH_BETA * math.log(1.0 - random.random()) >= ttl
 
-    # Calculate score
+
+def _present(np, column):
+    return np.fromiter(map(bool, column), dtype=bool, count=len(column))
+
+
+def _with_legacy_scores(store, rows, scores) -> list:
+    # Migration mode: scores missing under the new keys are read under the legacy keys of their
+    # (phone, birthday, first_name, last_name) rows with one more bulk read
+    missing = [i for i, score in enumerate(scores) if score is None]
+    if not missing or not score_keys.READ_LEGACY_KEYS:
+        return scores
+    scores = list(scores)
+    legacy = store.cache_get_many([score_keys.legacy_score_key(*rows[i]) for i in missing])
+    for i, score in zip(missing, legacy):
+        scores[i] = score
+    return scores
+
+
+def _compute_score(phone, email, birthday, gender, first_name, last_name) -> float:
     score = 0.0
     if phone:
         score += 1.5
@@ -38,16 +214,196 @@ def get_score(
         score += 1.5
     if first_name and last_name:
         score += 0.5
-
-    # Cache the score for 60 minutes
-    store.cache_set(key, score, 60 * 60)
     return score
 
 
+def interests_prefix(version=None) -> str:
+    return f"i:{version}:" if version else "i:"
+
+
+def current_interests_prefix(store) -> str:
+    cached = _interests_prefixes.get(store)
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+    return _remember_prefix(store, store.get(INTERESTS_POINTER))
+
+
+async def current_interests_prefix_async(store) -> str:
+    cached = _interests_prefixes.get(store)
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+    return _remember_prefix(store, await store.get(INTERESTS_POINTER))
+
+
+def _remember_prefix(store, version) -> str:
+    prefix = interests_prefix(version.decode("utf-8") if isinstance(version, bytes) else version)
+    _interests_prefixes[store] = (prefix, time.monotonic() + INTERESTS_PREFIX_TTL)
+    return prefix
+
+
 def get_interests(store, cid: str) -> list:
-    r = store.get(f"i:{cid}")
-    logging.info(f" Cache value {r} ")
-    if r:
-        return json.loads(r)
+    prefix = current_interests_prefix(store)
+    [key] = _interests_keys(store, prefix, [cid], _bloom_for(store, prefix))
+    [r] = _remember_missing(store, [key], [store.get(key)] if key else [])
+    logging.debug("Cache value %s", r)
+    if r is not None:
+        return _load_interests(r, _vocabulary_for(store, prefix, [r]))
     else:
         raise KeyError(f"Values with key {cid} doesn't exist in cache'")
+
+
+def get_interests_many(store, cids: list) -> dict:
+    prefix = current_interests_prefix(store)
+    keys = _interests_keys(store, prefix, cids, _bloom_for(store, prefix))
+    _check_known_missing(cids, keys)
+    values = _remember_missing(store, keys, store.get_many(keys))
+    return _interests_from_values(cids, values, _vocabulary_for(store, prefix, values))
+
+
+def find_interests(store, cids: list) -> dict:
+    """
+    Like get_interests_many, but missing ids are mapped to None instead of raising KeyError.
+    """
+    prefix = current_interests_prefix(store)
+    keys = _interests_keys(store, prefix, cids, _bloom_for(store, prefix))
+    wanted = [key for key in keys if key is not None]
+    values = _remember_missing(store, keys, store.get_many(wanted) if wanted else [])
+    vocabulary = _vocabulary_for(store, prefix, values)
+    return {cid: _load_interests(r, vocabulary) if r is not None else None for cid, r in zip(cids, values)}
+
+
+def iter_interests(store, cids: list, batch_size=1000):
+    """
+    Yield find_interests results for consecutive batches of `batch_size` ids, one store read per batch.
+    """
+    for start in range(0, len(cids), batch_size):
+        end = start + batch_size
+        yield find_interests(store, cids[start:end])
+
+
+async def get_interests_many_async(store: store.AsyncStore, cids: list) -> dict:
+    prefix = await current_interests_prefix_async(store)
+    bloom = _cached_bloom(store, prefix)
+    if bloom is False:
+        bloom = _remember_bloom(store, prefix, await store.get(f"{prefix}{INTERESTS_BLOOM}"))
+    keys = _interests_keys(store, prefix, cids, bloom)
+    _check_known_missing(cids, keys)
+    values = _remember_missing(store, keys, await store.get_many(keys))
+    vocabulary = None
+    if _has_packed(values):
+        vocabulary = _cached_vocabulary(store, prefix) or _remember_vocabulary(
+            store, prefix, await store.get(f"{prefix}{INTERESTS_VOCABULARY}")
+        )
+    return _interests_from_values(cids, values, vocabulary)
+
+
+def pack_interests(ids) -> bytes:
+    """
+    Encode interest ids into the version vocabulary as a packed value.
+    """
+    packed = array.array("H", ids)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return PACKED_INTERESTS + packed.tobytes()
+
+
+def _unpack_interests(value: bytes, vocabulary: list) -> list:
+    ids = array.array("H", value[1:])
+    if sys.byteorder == "big":
+        ids.byteswap()
+    return [vocabulary[i] for i in ids]
+
+
+def _interests_keys(store, prefix, cids, bloom=None) -> list:
+    # Store keys for the ids, None for ids known to be missing
+    negative = _negative_caches.get(store)
+    now = time.monotonic()
+    keys = []
+    for cid in cids:
+        key = f"{prefix}{cid}"
+        if (bloom is not None and cid not in bloom) or (negative and negative.get(key, 0.0) > now):
+            key = None
+        keys.append(key)
+    return keys
+
+
+def _check_known_missing(cids, keys):
+    missing = [cid for cid, key in zip(cids, keys) if key is None]
+    if missing:
+        raise KeyError(f"Values with keys {missing} don't exist in cache")
+
+
+def _remember_missing(store, keys, found) -> list:
+    # Values of the keys that were read in key order, None for the skipped ones; keys that were read
+    # and not found are added to the negative cache
+    found = iter(found)
+    values = [None if key is None else next(found) for key in keys]
+    missing = [key for key, r in zip(keys, values) if key is not None and r is None]
+    if missing and NEGATIVE_CACHE_TTL:
+        negative = _negative_caches.get(store)
+        if negative is None or len(negative) + len(missing) > NEGATIVE_CACHE_SIZE:
+            negative = _negative_caches[store] = {}
+        negative.update(dict.fromkeys(missing, time.monotonic() + NEGATIVE_CACHE_TTL))
+    return values
+
+
+def _bloom_for(store, prefix):
+    # The filter is read once per dataset version
+    bloom = _cached_bloom(store, prefix)
+    if bloom is False:
+        bloom = _remember_bloom(store, prefix, store.get(f"{prefix}{INTERESTS_BLOOM}"))
+    return bloom
+
+
+def _cached_bloom(store, prefix):
+    # False when the filter of this version wasn't read yet, None when the version has none
+    cached = _blooms.get(store)
+    return cached[1] if cached is not None and cached[0] == prefix else False
+
+
+def _remember_bloom(store, prefix, data):
+    bloom = BloomFilter.from_bytes(data) if isinstance(data, (bytes, bytearray)) else None
+    _blooms[store] = (prefix, bloom)
+    return bloom
+
+
+def _has_packed(values) -> bool:
+    return any(isinstance(r, bytes) and r[:1] == PACKED_INTERESTS for r in values)
+
+
+def _vocabulary_for(store, prefix, values):
+    # The vocabulary is read only when packed values are met, and once per dataset version
+    if not _has_packed(values):
+        return None
+    return _cached_vocabulary(store, prefix) or _remember_vocabulary(
+        store, prefix, store.get(f"{prefix}{INTERESTS_VOCABULARY}")
+    )
+
+
+def _cached_vocabulary(store, prefix):
+    cached = _vocabularies.get(store)
+    return cached[1] if cached is not None and cached[0] == prefix else None
+
+
+def _remember_vocabulary(store, prefix, vocabulary):
+    if not vocabulary:
+        raise KeyError(f"Interests vocabulary {prefix}{INTERESTS_VOCABULARY} doesn't exist in cache")
+    _vocabularies[store] = (prefix, vocabulary)
+    return vocabulary
+
+
+def _interests_from_values(cids: list, values: list, vocabulary=None) -> dict:
+    missing = [cid for cid, r in zip(cids, values) if r is None]
+    if missing:
+        raise KeyError(f"Values with keys {missing} don't exist in cache")
+    return {cid: _load_interests(r, vocabulary) for cid, r in zip(cids, values)}
+
+
+def _load_interests(value, vocabulary=None) -> list:
+    # Interests are stored as ids into the version vocabulary, as a JSON document
+    # or as a list decoded by the store codec
+    if isinstance(value, bytes) and value[:1] == PACKED_INTERESTS:
+        return _unpack_interests(value, vocabulary)
+    if isinstance(value, (bytes, str)):
+        return json.loads(value)
+    return value
@@ -0,0 +1,213 @@
+import json
+import logging
+import math
+import os
+import queue
+import selectors
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer
+
+from scoring import api
+
+
+class SerialHTTPServer(HTTPServer):
+    """
+    HTTP server that handles one connection at a time.
+    A keep-alive connection would block every other client, so connections are closed after each response.
+    """
+
+    def __init__(self, server_address, handler_class):
+        handler_class = type(handler_class.__name__, (handler_class,), {"protocol_version": "HTTP/1.0"})
+        super().__init__(server_address, handler_class)
+
+
+class _OneRequestHandler:
+    """
+    Handler mixin for ThreadPoolHTTPServer: every call of handle() serves one request,
+    the connection stays open until the server calls close().
+    """
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+
+    def finish(self):
+        pass
+
+    def close(self):
+        super().finish()
+
+    def has_buffered_request(self):
+        # Bytes of a pipelined request may already be in the read buffer, the selector would not see them
+        self.connection.settimeout(0.0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+
+class ThreadPoolHTTPServer(HTTPServer):
+    """
+    HTTP server that handles requests on a bounded pool of worker threads.
+    At most `queue_size` requests wait for a free worker, the rest are answered with 503 right away.
+    Between requests keep-alive connections don't hold a worker: a selector thread watches them and hands
+    a connection back to the pool when its next request arrives. Connections idle for longer than the handler
+    `timeout` are closed.
+    """
+
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, workers=8, queue_size=64):
+        handler_class = type(handler_class.__name__, (_OneRequestHandler, handler_class), {})
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http-worker")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._idle = queue.SimpleQueue()  # Handlers waiting for their next request, registered by the watcher
+        self._closing = False
+        self._wakeup, self._wakeup_writer = socket.socketpair()
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._wakeup, selectors.EVENT_READ)
+        self._watcher = threading.Thread(target=self._watch_idle, name="http-idle", daemon=True)
+        self._watcher.start()
+
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(blocking=False):
+            self.reject_request(request)
+            return
+        self.executor.submit(self._process_request, request, client_address)
+
+    def reject_request(self, request):
+        body = json.dumps({"error": api.ERRORS[api.SERVICE_UNAVAILABLE], "code": api.SERVICE_UNAVAILABLE})
+        response = (
+            f"HTTP/1.1 {api.SERVICE_UNAVAILABLE} {api.ERRORS[api.SERVICE_UNAVAILABLE]}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n{body}"
+        )
+        try:
+            request.sendall(response.encode("utf-8"))
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._closing = True
+        self._wakeup_writer.send(b"\0")
+        self._watcher.join()
+        self.executor.shutdown(wait=True)
+        while not self._idle.empty():
+            self._close_connection(self._idle.get())
+        self._wakeup_writer.close()
+
+    def _process_request(self, request, client_address):
+        try:
+            handler = self.RequestHandlerClass(request, client_address, self)  # Serves the first request
+        except Exception:
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+        else:
+            self._after_request(handler)
+        finally:
+            self._slots.release()
+
+    def _process_next_request(self, handler):
+        try:
+            self._handle(handler)
+            self._after_request(handler)
+        finally:
+            self._slots.release()
+
+    def _handle(self, handler):
+        try:
+            handler.handle()
+        except Exception:
+            self.handle_error(handler.connection, handler.client_address)
+            handler.close_connection = True
+
+    def _after_request(self, handler):
+        while not handler.close_connection and handler.has_buffered_request():
+            self._handle(handler)
+        if handler.close_connection or self._closing:
+            self._close_connection(handler)
+        else:
+            self._idle.put(handler)
+            self._wakeup_writer.send(b"\0")
+
+    def _resume(self, handler):
+        # The next request of an idle connection arrived, it waits for a worker like a new connection
+        if not self._slots.acquire(blocking=False):
+            handler.close()
+            self.reject_request(handler.connection)
+            return
+        self.executor.submit(self._process_next_request, handler)
+
+    def _close_connection(self, handler):
+        try:
+            handler.close()
+        except OSError:
+            pass
+        self.shutdown_request(handler.connection)
+
+    def _watch_idle(self):
+        # The only thread that touches the selector: workers pass idle connections through self._idle
+        expires = {}  # handler -> monotonic time it is closed at
+        while not self._closing:
+            for key, _ in self._selector.select(timeout=1.0):
+                if key.fileobj is self._wakeup:
+                    self._wakeup.recv(4096)
+                    continue
+                self._selector.unregister(key.fileobj)
+                del expires[key.data]
+                self._resume(key.data)
+            while not self._idle.empty():
+                handler = self._idle.get()
+                self._selector.register(handler.connection, selectors.EVENT_READ, handler)
+                expires[handler] = math.inf if handler.timeout is None else time.monotonic() + handler.timeout
+            now = time.monotonic()
+            for handler in [handler for handler, expires_at in expires.items() if expires_at <= now]:
+                self._selector.unregister(handler.connection)
+                del expires[handler]
+                self._close_connection(handler)
+        for handler in expires:
+            self._close_connection(handler)
+        self._selector.close()
+        self._wakeup.close()
+
+
+def serve_prefork(server, workers, init_worker=None):
+    """
+    Fork `workers` processes that accept connections on the listening socket of `server`.
+    `init_worker` runs in every child before it starts serving, e.g. to open its own store connections.
+    """
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+            try:
+                if init_worker:
+                    init_worker()
+                server.serve_forever()
+            finally:
+                logging.shutdown()  # Write out queued log records, os._exit skips exit handlers
+                os._exit(0)
+        children.append(pid)
+    logging.info("Started %s worker processes: %s", workers, children)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)  # Process group signals may arrive again
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
@@ -1,21 +1,48 @@
-﻿import logging
+﻿import asyncio
+import bisect
+import contextvars
+import hashlib
+import json
+import logging
+import math
+import mmap
+import multiprocessing
+import os
 import pickle
+import random
+import struct
+import sys
 import threading
 import time
+import zlib
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import redis
+import redis.asyncio
+
+from scoring import metrics
+
+
+class StoreUnavailableError(ConnectionError):
+    pass
 
 
 class Store(ABC):
-    _instance = None
+    _shared = True  # Share the instance between callers with the same constructor arguments
+    _instances = {}  # One instance per process, store class and constructor arguments
     _lock = threading.Lock()  # Lock to make it thread-safe
 
-    def __new__(cls):
+    def __new__(cls, *args, **kwargs):
+        if not cls._shared:
+            return super(Store, cls).__new__(cls)
+        # Forked workers get their own instances instead of the connections inherited from the parent
+        key = (os.getpid(), cls, args, tuple(sorted(kwargs.items())))
         with cls._lock:
-            if not cls._instance:
-                cls._instance = super(Store, cls).__new__(cls)
-        return cls._instance
+            if key not in cls._instances:
+                cls._instances[key] = super(Store, cls).__new__(cls)
+        return cls._instances[key]
 
     @abstractmethod
     def get(self, key):
@@ -24,6 +51,14 @@ class Store(ABC):
         """
         pass
 
+    @abstractmethod
+    def get_many(self, keys):
+        """
+        Retrieve the values for several keys at once, in the order of the given keys.
+        Missing keys are returned as None.
+        """
+        pass
+
     @abstractmethod
     def cache_get(self, key, cache_duration=60):
         """
@@ -31,6 +66,26 @@ class Store(ABC):
         """
         pass
 
+    def cache_get_many(self, keys):
+        """
+        Get several cached values at once, in the order of the given keys.
+        Missing or expired keys are returned as None.
+        """
+        return [self.cache_get(key) for key in keys]
+
+    def cache_get_with_ttl(self, key):
+        """
+        Get a cached value together with its remaining lifetime in seconds.
+        Returns (None, None) for a miss; the lifetime is None when it is unknown or unlimited.
+        """
+        return self.cache_get(key), None
+
+    def get_with_ttl(self, key):
+        """
+        Like cache_get_with_ttl, but stores that can fail raise StoreUnavailableError instead of returning a miss.
+        """
+        return self.cache_get_with_ttl(key)
+
     @abstractmethod
     def cache_set(self, key, value, cache_duration=60):
         """
@@ -38,65 +93,1151 @@ class Store(ABC):
         """
         pass
 
+    def cache_set_many(self, items, cache_duration=60):
+        """
+        Set several (key, value) pairs with the same expiration time, None keeps them without expiration.
+        """
+        for key, value in items:
+            self.cache_set(key, value, cache_duration)
+
+    def set_many(self, items, cache_duration=None):
+        """
+        Like cache_set_many, but for data that must be written completely:
+        stores that can fail raise StoreUnavailableError instead of skipping the write.
+        """
+        self.cache_set_many(items, cache_duration)
+
+    def expire_prefix(self, prefix, cache_duration):
+        """
+        Make every key that starts with `prefix` expire in `cache_duration` seconds.
+        Returns the number of keys; stores that can fail raise StoreUnavailableError.
+        """
+        raise NotImplementedError(f"{type(self).__name__} can't expire keys by prefix")
+
     @abstractmethod
     def check(self):
         pass
 
 
+class AsyncStore(ABC):
+    """
+    Asyncio counterpart of Store.
+    """
+
+    @abstractmethod
+    async def get(self, key):
+        pass
+
+    @abstractmethod
+    async def get_many(self, keys):
+        pass
+
+    @abstractmethod
+    async def cache_get(self, key):
+        pass
+
+    @abstractmethod
+    async def cache_set(self, key, value, cache_duration=60):
+        pass
+
+    @abstractmethod
+    async def check(self):
+        pass
+
+
+class Codec(ABC):
+    """
+    Serialization format for stored values.
+    Encoded values are prefixed with the one-byte codec tag, so several formats can coexist in one keyspace.
+    """
+
+    tag = b""
+
+    @abstractmethod
+    def encode(self, value) -> bytes:
+        pass
+
+    @abstractmethod
+    def decode(self, data: bytes):
+        pass
+
+
+class RawCodec(Codec):
+    """
+    Bytes are stored as is.
+    """
+
+    tag = b"\x01"
+
+    def encode(self, value) -> bytes:
+        return bytes(value)
+
+    def decode(self, data: bytes):
+        return data
+
+
+class JsonCodec(Codec):
+    tag = b"\x02"
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def encode(self, value) -> bytes:
+        return self._encoder.encode(value).encode("utf-8")
+
+    def decode(self, data: bytes):
+        return json.loads(data)
+
+
+class BinaryCodec(Codec):
+    """
+    Compact format for the value types used by scoring: floats, ints, bytes, strings and lists of strings.
+    The first payload byte is the value type.
+    """
+
+    tag = b"\x03"
+    _double = struct.Struct("!d")
+    _long = struct.Struct("!q")
+    _count = struct.Struct("!I")
+
+    def encode(self, value) -> bytes:
+        if isinstance(value, float):
+            return b"d" + self._double.pack(value)
+        if isinstance(value, int) and not isinstance(value, bool):
+            return b"q" + self._long.pack(value)
+        if isinstance(value, (bytes, bytearray)):
+            return b"b" + value
+        if isinstance(value, str):
+            return b"s" + value.encode("utf-8")
+        if isinstance(value, (list, tuple)) and all(isinstance(item, str) and "\0" not in item for item in value):
+            # Strings are joined with NUL, so the whole list is decoded with one split
+            return b"l" + self._count.pack(len(value)) + "\0".join(value).encode("utf-8")
+        raise TypeError(f"BinaryCodec can't encode {type(value).__name__}")
+
+    def decode(self, data: bytes):
+        kind = data[:1]
+        if kind == b"d":
+            return self._double.unpack_from(data, 1)[0]
+        if kind == b"q":
+            return self._long.unpack_from(data, 1)[0]
+        if kind == b"b":
+            return data[1:]
+        if kind == b"s":
+            return data[1:].decode("utf-8")
+        if kind == b"l":
+            if not self._count.unpack_from(data, 1)[0]:
+                return []
+            offset = 1 + self._count.size
+            return data[offset:].decode("utf-8").split("\0")
+        raise ValueError(f"Unknown binary value type {kind!r}")
+
+
+class PickleCodec(Codec):
+    """
+    Untagged pickle, the format of versions before the codecs. Write it during a rollout while servers of those
+    versions still read the keyspace, new servers read it only with legacy_pickle.
+    """
+
+    tag = b""
+
+    def encode(self, value) -> bytes:
+        return pickle.dumps(value)
+
+    def decode(self, data: bytes):
+        return pickle.loads(data)
+
+
+RAW = RawCodec()
+JSON = JsonCodec()
+BINARY = BinaryCodec()
+PICKLE = PickleCodec()
+CODECS = {codec.tag: codec for codec in (RAW, JSON, BINARY)}
+PICKLE_MARK = b"\x80"  # First byte of values pickled before the codecs were introduced
+VALUE_FORMATS = {"binary": BINARY, "json": JSON, "pickle": PICKLE}  # Formats new values can be written in
+
+
+def encode_value(value, codec: Codec = BINARY) -> bytes:
+    return codec.tag + codec.encode(value)
+
+
+def decode_value(data: bytes, legacy_pickle=False):
+    codec = CODECS.get(data[:1])
+    if codec is not None:
+        return codec.decode(data[1:])
+    if legacy_pickle and data[:1] == PICKLE_MARK:
+        return pickle.loads(data)
+    raise ValueError(f"Unknown value format {data[:1]!r}")
+
+
+class CircuitBreaker:
+    """
+    Failure-driven circuit breaker.
+    After `failure_threshold` consecutive failures the circuit opens and calls fail fast
+    until the backoff expires. Every failure while the circuit is half-open doubles the backoff
+    up to `backoff_max`; the first success closes the circuit again.
+    """
+
+    def __init__(self, failure_threshold=3, backoff_base=0.5, backoff_max=30.0):
+        self.failure_threshold = failure_threshold
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failures = 0
+        self.opened_until = 0.0
+        self._backoff = backoff_base
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return time.monotonic() < self.opened_until
+
+    def allow(self):
+        return not self.failures or not self.is_open
+
+    def record_success(self):
+        if self.failures:
+            with self._lock:
+                self.failures = 0
+                self.opened_until = 0.0
+                self._backoff = self.backoff_base
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_until = time.monotonic() + self._backoff
+                self._backoff = min(self._backoff * 2, self.backoff_max)
+
+
 class RedisStore(Store):
-    def __init__(self, host="localhost", port=6379, db=0, socket_timeout=2, retry_delay=1, max_retries=2):
-        # Initialize the Redis client
+    def __init__(
+        self,
+        host="localhost",
+        port=6379,
+        db=0,
+        socket_timeout=2,
+        max_connections=50,
+        failure_threshold=3,
+        backoff_base=0.5,
+        backoff_max=30.0,
+        health_interval=5.0,
+        codec=BINARY,
+        legacy_pickle=False,
+    ):
+        # The instance is shared, so it is initialized only once
+        if getattr(self, "_initialized", False):
+            return
         self.host = host
         self.port = port
         self.db = db
         self.socket_timeout = socket_timeout
-        self.max_retries = max_retries
-        self.retry_delay = retry_delay  # Delay between retries in seconds
+        self.max_connections = max_connections
+        self.health_interval = health_interval  # Seconds between background PINGs, 0 disables the probe
+        self.breaker = CircuitBreaker(failure_threshold, backoff_base, backoff_max)
+        self.codec = codec  # Format for new values, values in any known format are readable
+        self.legacy_pickle = legacy_pickle  # Unpickle values left by older versions, only for a trusted keyspace
         self.connect()
+        self._stop_probe = threading.Event()
+        if health_interval:
+            threading.Thread(target=self._probe, name=f"redis-probe-{host}:{port}", daemon=True).start()
+        self._initialized = True
 
     def get(self, key):
         """
         Retrieve the value from Redis.
         If the key is not found, return None.
+        Raise StoreUnavailableError if Redis can't be reached.
         """
-        if self.check():
-            value = self.client.get(key)
-            if value:
-                # Deserialize the value before returning
-                return pickle.loads(value)
+        value = self._execute("get", key)
+        if value:
+            # Deserialize the value before returning
+            return decode_value(value, self.legacy_pickle)
         return None
 
+    def get_many(self, keys):
+        """
+        Retrieve the values for all keys with a single MGET round trip.
+        Keys that are not found are returned as None.
+        """
+        keys = list(keys)
+        if not keys:
+            return []
+        return [decode_value(value, self.legacy_pickle) if value else None for value in self._execute("mget", keys)]
+
     def cache_get(self, key):
         """
-        Attempt to get the value from Redis. If the value is not found or expired,
-        cache the value for the given duration (in seconds).
+        Attempt to get the value from Redis. The cache is optional,
+        so None is returned when Redis is unavailable.
         """
-        value = self.get(key)
-        return value
+        try:
+            return self.get(key)
+        except StoreUnavailableError as e:
+            logging.warning("Cache read failed: %s", e)
+            return None
+
+    def cache_get_many(self, keys):
+        """
+        Get several cached values with a single MGET, all misses when Redis is unavailable.
+        """
+        keys = list(keys)
+        try:
+            return self.get_many(keys)
+        except StoreUnavailableError as e:
+            logging.warning("Cache read failed: %s", e)
+            return [None] * len(keys)
+
+    def cache_get_with_ttl(self, key):
+        """
+        Get a cached value and its remaining lifetime, a miss when Redis is unavailable.
+        """
+        try:
+            return self.get_with_ttl(key)
+        except StoreUnavailableError as e:
+            logging.warning("Cache read failed: %s", e)
+            return None, None
+
+    def get_with_ttl(self, key):
+        """
+        Get a value and its remaining lifetime with GET and PTTL in one round trip.
+        Raise StoreUnavailableError if Redis can't be reached.
+        """
+        value, ttl = self._execute_pipeline([("get", key), ("pttl", key)])
+        if not value:
+            return None, None
+        return decode_value(value, self.legacy_pickle), ttl / 1000 if ttl >= 0 else None
 
     def cache_set(self, key, value, cache_duration=60):
         """
         Set a value in Redis with an optional expiration time.
+        Failures are logged and ignored.
+        """
+        serialized_value = encode_value(value, self.codec)
+        try:
+            self._execute("setex", key, cache_duration, serialized_value)
+        except StoreUnavailableError as e:
+            logging.warning("Cache write failed: %s", e)
+
+    def cache_set_many(self, items, cache_duration=60):
+        """
+        Set several values in one pipelined round trip, None keeps them without expiration.
+        Failures are logged and ignored.
         """
-        if self.check():
-            serialized_value = pickle.dumps(value)
-            self.client.setex(key, cache_duration, serialized_value)
+        try:
+            self.set_many(items, cache_duration)
+        except StoreUnavailableError as e:
+            logging.warning("Cache write failed: %s", e)
+
+    def set_many(self, items, cache_duration=None):
+        """
+        Set several values in one pipelined round trip.
+        Raise StoreUnavailableError if Redis can't be reached.
+        """
+        if cache_duration is None:
+            commands = [("set", key, encode_value(value, self.codec)) for key, value in items]
+        else:
+            commands = [("setex", key, cache_duration, encode_value(value, self.codec)) for key, value in items]
+        if commands:
+            self._execute_pipeline(commands)
+
+    def expire_prefix(self, prefix, cache_duration, batch_size=1000):
+        """
+        Walk the keys with SCAN and set their expiration with pipelined EXPIRE, `batch_size` keys at a time.
+        """
+        pattern = "".join("\\" + char if char in "*?[]\\" else char for char in prefix) + "*"
+        cursor, count = None, 0
+        while cursor != 0:
+            cursor, keys = self._execute("scan", cursor or 0, pattern, batch_size)
+            if keys:
+                self._execute_pipeline([("expire", key, cache_duration) for key in keys])
+                count += len(keys)
+        return count
 
     def connect(self):
-        self.client = redis.StrictRedis(host=self.host, port=self.port, db=self.db, socket_timeout=self.socket_timeout)
+        self.pool = redis.BlockingConnectionPool(
+            host=self.host,
+            port=self.port,
+            db=self.db,
+            socket_timeout=self.socket_timeout,
+            socket_connect_timeout=self.socket_timeout,
+            max_connections=self.max_connections,
+            timeout=self.socket_timeout,  # How long to wait for a free connection
+        )
+        self.client = redis.StrictRedis(connection_pool=self.pool)
+
+    def close(self):
+        self._stop_probe.set()
+        self.pool.disconnect()
 
     def check(self):
-        attempt = 0
-        while attempt < self.max_retries:
-            try:
-                # Test the connection
+        """
+        Send a single PING and update the circuit breaker with the result.
+        """
+        try:
+            with metrics.store_operation("ping"):
                 self.client.ping()
-                logging.info("connection try")
-                return True
-            except redis.TimeoutError as e:
-                attempt += 1
-                logging.info(f"Connection attempt {attempt} failed: {e}")
-                logging.info(f"Retrying in {self.retry_delay} seconds...")
-                time.sleep(self.retry_delay)
-                self.connect()
+        except (redis.ConnectionError, redis.TimeoutError) as e:
+            logging.info("Redis health check failed: %s", e)
+            self.breaker.record_failure()
+            return False
+        self.breaker.record_success()
+        return True
+
+    def _probe(self):
+        while not self._stop_probe.wait(self.health_interval):
+            self.check()
+
+    def _execute(self, command, *args):
+        if not self.breaker.allow():
+            raise StoreUnavailableError(f"Redis at {self.host}:{self.port} is unavailable")
+        try:
+            with metrics.store_operation(command):
+                result = getattr(self.client, command)(*args)
+        except (redis.ConnectionError, redis.TimeoutError) as e:
+            self.breaker.record_failure()
+            raise StoreUnavailableError(f"Redis at {self.host}:{self.port} is unavailable: {e}") from e
+        self.breaker.record_success()
+        return result
+
+    def _execute_pipeline(self, commands):
+        # Send (command, *args) tuples in one round trip, without MULTI/EXEC
+        if not self.breaker.allow():
+            raise StoreUnavailableError(f"Redis at {self.host}:{self.port} is unavailable")
+        pipeline = self.client.pipeline(transaction=False)
+        for command, *args in commands:
+            getattr(pipeline, command)(*args)
+        try:
+            with metrics.store_operation(f"pipeline_{commands[0][0]}"):
+                results = pipeline.execute()
+        except (redis.ConnectionError, redis.TimeoutError) as e:
+            self.breaker.record_failure()
+            raise StoreUnavailableError(f"Redis at {self.host}:{self.port} is unavailable: {e}") from e
+        self.breaker.record_success()
+        return results
+
+
+class AsyncRedisStore(AsyncStore):
+    """
+    RedisStore for asyncio applications, built on redis.asyncio.
+    The connection pool belongs to the event loop the store is first used in.
+    """
+
+    def __init__(
+        self,
+        host="localhost",
+        port=6379,
+        db=0,
+        socket_timeout=2,
+        max_connections=100,
+        failure_threshold=3,
+        backoff_base=0.5,
+        backoff_max=30.0,
+        health_interval=5.0,
+        codec=BINARY,
+        legacy_pickle=False,
+    ):
+        self.host = host
+        self.port = port
+        self.health_interval = health_interval
+        self.breaker = CircuitBreaker(failure_threshold, backoff_base, backoff_max)
+        self.codec = codec
+        self.legacy_pickle = legacy_pickle
+        self.pool = redis.asyncio.BlockingConnectionPool(
+            host=host,
+            port=port,
+            db=db,
+            socket_timeout=socket_timeout,
+            socket_connect_timeout=socket_timeout,
+            max_connections=max_connections,
+            timeout=socket_timeout,
+        )
+        self.client = redis.asyncio.StrictRedis(connection_pool=self.pool)
+        self._probe_task = None
+
+    async def get(self, key):
+        value = await self._execute("get", key)
+        if value:
+            return decode_value(value, self.legacy_pickle)
+        return None
+
+    async def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return []
+        values = await self._execute("mget", keys)
+        return [decode_value(value, self.legacy_pickle) if value else None for value in values]
+
+    async def cache_get(self, key):
+        try:
+            return await self.get(key)
+        except StoreUnavailableError as e:
+            logging.warning("Cache read failed: %s", e)
+            return None
+
+    async def cache_set(self, key, value, cache_duration=60):
+        try:
+            await self._execute("setex", key, cache_duration, encode_value(value, self.codec))
+        except StoreUnavailableError as e:
+            logging.warning("Cache write failed: %s", e)
+
+    async def check(self):
+        try:
+            with metrics.store_operation("ping"):
+                await self.client.ping()
+        except (redis.ConnectionError, redis.TimeoutError) as e:
+            logging.info("Redis health check failed: %s", e)
+            self.breaker.record_failure()
             return False
+        self.breaker.record_success()
+        return True
+
+    def start_health_probe(self):
+        """
+        Start the background PING task in the running event loop.
+        """
+        if self.health_interval and self._probe_task is None:
+            self._probe_task = asyncio.get_running_loop().create_task(self._probe())
+
+    async def close(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+        await self.pool.disconnect()
+
+    async def _probe(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check()
+
+    async def _execute(self, command, *args):
+        if not self.breaker.allow():
+            raise StoreUnavailableError(f"Redis at {self.host}:{self.port} is unavailable")
+        try:
+            with metrics.store_operation(command):
+                result = await getattr(self.client, command)(*args)
+        except (redis.ConnectionError, redis.TimeoutError) as e:
+            self.breaker.record_failure()
+            raise StoreUnavailableError(f"Redis at {self.host}:{self.port} is unavailable: {e}") from e
+        self.breaker.record_success()
+        return result
+
+
+class LocalCacheStore(Store):
+    """
+    In-process LRU cache in front of another store.
+    Only cache_get/cache_set go through the local cache, get/get_many always reach the wrapped store.
+    Entries expire after the cache_duration passed to cache_set, values read from the wrapped store
+    are kept for `read_ttl` seconds. The cache is bounded both by entry count and by estimated memory size.
+    """
+
+    _shared = False
+
+    def __init__(self, store, max_entries=10000, max_bytes=16 * 1024 * 1024, read_ttl=5):
+        self.store = store
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.read_ttl = read_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._entries = OrderedDict()  # key -> (value, expires_at, size)
+        self._entries_lock = threading.Lock()
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def get_many(self, keys):
+        return self.store.get_many(keys)
+
+    def cache_get(self, key):
+        value = self._get_local(key)
+        if value is None:
+            value = self.store.cache_get(key)
+            if value is not None:
+                self._put(key, value, self.read_ttl)
+        return value
+
+    def cache_get_many(self, keys):
+        keys = list(keys)
+        values = [self._get_local(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        if missing:
+            for i, value in zip(missing, self.store.cache_get_many([keys[i] for i in missing])):
+                if value is not None:
+                    self._put(keys[i], value, self.read_ttl)
+                values[i] = value
+        return values
+
+    def cache_get_with_ttl(self, key):
+        # Local entries don't track the lifetime left in the wrapped store
+        value = self._get_local(key)
+        if value is not None:
+            return value, None
+        value, ttl = self.store.cache_get_with_ttl(key)
+        if value is not None:
+            self._put(key, value, self.read_ttl if ttl is None else min(self.read_ttl, ttl))
+        return value, ttl
+
+    def cache_set(self, key, value, cache_duration=60):
+        self.store.cache_set(key, value, cache_duration)
+        self._put(key, value, cache_duration)
+
+    def cache_set_many(self, items, cache_duration=60):
+        items = list(items)
+        self.store.cache_set_many(items, cache_duration)
+        for key, value in items:
+            self._put(key, value, cache_duration)
+
+    def set_many(self, items, cache_duration=None):
+        self.store.set_many(items, cache_duration)
+
+    def expire_prefix(self, prefix, cache_duration):
+        return self.store.expire_prefix(prefix, cache_duration)
+
+    def check(self):
+        return self.store.check()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.size,
+        }
+
+    def _get_local(self, key):
+        with self._entries_lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                self._remove(key)
+            self.misses += 1
+        return None
+
+    def _put(self, key, value, ttl):
+        size = _estimate_size(key) + _estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self._entries_lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, math.inf if ttl is None else time.monotonic() + ttl, size)
+            self.size += size
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self.size -= self._entries.popitem(last=False)[1][2]
+                self.evictions += 1
+
+    def _remove(self, key):
+        self.size -= self._entries.pop(key)[2]
+
+
+class InMemoryStore(Store):
+    """
+    Process-local store with per-key expiration.
+    Expired keys are dropped when they are read and by a background sweep every `sweep_interval` seconds.
+    """
+
+    _shared = False
+
+    def __init__(self, sweep_interval=30.0):
+        self.sweep_interval = sweep_interval
+        self._values = {}  # key -> (value, expires_at or None)
+        self._values_lock = threading.Lock()
+        self._sweeper_pid = None
+
+    def get(self, key):
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            with self._values_lock:
+                if self._values.get(key) is entry:
+                    del self._values[key]
+            return None
+        return entry[0]
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def cache_get(self, key):
+        return self.get(key)
+
+    def cache_get_with_ttl(self, key):
+        entry = self._values.get(key)
+        if entry is None:
+            return None, None
+        if entry[1] is None:
+            return entry[0], None
+        ttl = entry[1] - time.monotonic()
+        return (entry[0], ttl) if ttl > 0 else (None, None)
+
+    def cache_set(self, key, value, cache_duration=60):
+        """
+        Set a value with an expiration time, None keeps the value until it is overwritten.
+        """
+        expires_at = None if cache_duration is None else time.monotonic() + cache_duration
+        with self._values_lock:
+            self._values[key] = (value, expires_at)
+        if self.sweep_interval and self._sweeper_pid != os.getpid():
+            self._start_sweeper()
+
+    def expire_prefix(self, prefix, cache_duration):
+        expires_at = time.monotonic() + cache_duration
+        count = 0
+        with self._values_lock:
+            for key, (value, old_expires_at) in list(self._values.items()):
+                if isinstance(key, str) and key.startswith(prefix):
+                    self._values[key] = (
+                        value,
+                        expires_at if old_expires_at is None else min(old_expires_at, expires_at),
+                    )
+                    count += 1
+        if self.sweep_interval and self._sweeper_pid != os.getpid():
+            self._start_sweeper()
+        return count
+
+    def check(self):
+        return True
+
+    def sweep(self, batch_size=1000):
+        """
+        Drop expired keys, holding the lock for at most `batch_size` keys at a time.
+        """
+        keys = list(self._values)
+        for start in range(0, len(keys), batch_size):
+            now, end = time.monotonic(), start + batch_size
+            with self._values_lock:
+                for key in keys[start:end]:
+                    entry = self._values.get(key)
+                    if entry is not None and entry[1] is not None and entry[1] <= now:
+                        del self._values[key]
+
+    def __len__(self):
+        return len(self._values)
+
+    def _start_sweeper(self):
+        # The sweeper thread doesn't survive fork, so every process starts its own
+        with self._values_lock:
+            if self._sweeper_pid == os.getpid():
+                return
+            self._sweeper_pid = os.getpid()
+        threading.Thread(target=self._sweep_forever, name="memory-store-sweeper", daemon=True).start()
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            self.sweep()
+
+
+class SharedMemoryStore(Store):
+    """
+    Fixed-size hash table in an anonymous shared memory map.
+    Create it before forking workers: the children see one table, so a score cached by one worker is
+    visible to all of them. Slots hold keys up to `max_key_size` and encoded values up to `max_value_size` bytes,
+    larger items are not cached and set_many rejects them. When all probed slots are taken, the entry closest to
+    expiration is replaced.
+    """
+
+    _shared = False
+    _header = struct.Struct("=BdHH")  # state, expires_at (0 - never), key size, value size
+    EMPTY, USED, DELETED = 0, 1, 2
+
+    def __init__(self, capacity=65536, max_key_size=64, max_value_size=192, max_probes=16, codec=BINARY):
+        self.capacity = capacity
+        self.max_key_size = max_key_size
+        self.max_value_size = max_value_size
+        self.max_probes = min(max_probes, capacity)
+        self.codec = codec
+        self.slot_size = self._header.size + max_key_size + max_value_size
+        self._memory = mmap.mmap(-1, capacity * self.slot_size)
+        self._memory_lock = multiprocessing.Lock()
+
+    def get(self, key):
+        key = self._encode_key(key)
+        with self._memory_lock:
+            offset = self._find(key, time.time())
+            if offset is None:
+                return None
+            value_size = self._header.unpack_from(self._memory, offset)[3]
+            start = offset + self._header.size + self.max_key_size
+            end = start + value_size
+            data = self._memory[start:end]
+        return decode_value(data)
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def cache_get(self, key):
+        return self.get(key)
+
+    def cache_set(self, key, value, cache_duration=60):
+        """
+        Set a value with an expiration time, None keeps the value until it is overwritten or evicted.
+        """
+        try:
+            item = self._encode_item(key, value)
+        except ValueError as e:
+            logging.warning("%s", e)
+            return
+        self._write(*item, cache_duration)
+
+    def set_many(self, items, cache_duration=None):
+        """
+        Set several values, raising ValueError before writing any of them if one doesn't fit into a slot.
+        """
+        for key, data in [self._encode_item(key, value) for key, value in items]:
+            self._write(key, data, cache_duration)
+
+    def expire_prefix(self, prefix, cache_duration):
+        prefix = self._encode_key(prefix)
+        count = 0
+        with self._memory_lock:
+            expires_at = time.time() + cache_duration
+            for offset in range(0, self.capacity * self.slot_size, self.slot_size):
+                state, old_expires_at, key_size, value_size = self._header.unpack_from(self._memory, offset)
+                key_start = offset + self._header.size
+                key_end = key_start + key_size
+                if state != self.USED or not self._memory[key_start:key_end].startswith(prefix):
+                    continue
+                if not old_expires_at or old_expires_at > expires_at:
+                    self._header.pack_into(self._memory, offset, state, expires_at, key_size, value_size)
+                count += 1
+        return count
+
+    def check(self):
+        return True
+
+    def _encode_item(self, key, value):
+        key = self._encode_key(key)
+        data = encode_value(value, self.codec)
+        if len(key) > self.max_key_size or len(data) > self.max_value_size:
+            raise ValueError(f"Value for {key!r} doesn't fit into a shared memory slot")
+        return key, data
+
+    def _write(self, key, data, cache_duration):
+        expires_at = 0.0 if cache_duration is None else time.time() + cache_duration
+        with self._memory_lock:
+            offset = self._slot_for_write(key, time.time())
+            self._header.pack_into(self._memory, offset, self.USED, expires_at, len(key), len(data))
+            key_start = offset + self._header.size
+            key_end = key_start + len(key)
+            self._memory[key_start:key_end] = key
+            value_start = key_start + self.max_key_size
+            value_end = value_start + len(data)
+            self._memory[value_start:value_end] = data
+
+    def _encode_key(self, key):
+        return key.encode("utf-8") if isinstance(key, str) else bytes(key)
+
+    def _probe(self, key):
+        home = zlib.crc32(key) % self.capacity
+        for i in range(self.max_probes):
+            yield ((home + i) % self.capacity) * self.slot_size
+
+    def _matches(self, offset, key):
+        start = offset + self._header.size
+        end = start + len(key)
+        return self._memory[start:end] == key
+
+    def _find(self, key, now):
+        for offset in self._probe(key):
+            state, expires_at, key_size, _ = self._header.unpack_from(self._memory, offset)
+            if state == self.EMPTY:
+                return None
+            if state == self.USED and key_size == len(key) and self._matches(offset, key):
+                if expires_at and expires_at <= now:
+                    self._memory[offset] = self.DELETED
+                    return None
+                return offset
+        return None
+
+    def _slot_for_write(self, key, now):
+        free, victim, victim_expires = None, None, float("inf")
+        for offset in self._probe(key):
+            state, expires_at, key_size, _ = self._header.unpack_from(self._memory, offset)
+            if state == self.USED and key_size == len(key) and self._matches(offset, key):
+                return offset
+            expired = state == self.USED and expires_at and expires_at <= now
+            if free is None and (state != self.USED or expired):
+                free = offset
+            if state == self.EMPTY:
+                break
+            if state == self.USED and (expires_at or float("inf")) < victim_expires:
+                victim, victim_expires = offset, expires_at or float("inf")
+        if free is not None:
+            return free
+        return victim if victim is not None else next(self._probe(key))
+
+
+class Replica:
+    """
+    Read replica with its own circuit breaker and an EWMA of read latency.
+    """
+
+    def __init__(self, store, breaker=None, alpha=0.2):
+        self.store = store
+        self.breaker = breaker or CircuitBreaker()
+        self.alpha = alpha  # Weight of the newest sample in the latency average
+        self.latency = 0.0
+
+    def read(self, method, *args):
+        start = time.perf_counter()
+        try:
+            result = getattr(self.store, method)(*args)
+        except StoreUnavailableError:
+            self.breaker.record_failure()
+            raise
+        self.latency += self.alpha * (time.perf_counter() - start - self.latency)
+        self.breaker.record_success()
+        return result
+
+
+class ReplicatedStore(Store):
+    """
+    Sends writes to the primary and spreads reads over the replicas.
+    A replica is picked by the power of two choices on the read latency average,
+    replicas behind an open circuit are skipped and reads fall back to the primary
+    when no replica answers. Replicas lag behind the primary, so a value that was
+    just cached may be missed once and computed again.
+    """
+
+    _shared = False
+
+    def __init__(self, primary, replicas=(), **breaker_options):
+        self.primary = primary
+        self.replicas = [Replica(replica, CircuitBreaker(**breaker_options)) for replica in replicas]
+
+    def get(self, key):
+        return self._read("get", key)
+
+    def get_many(self, keys):
+        return self._read("get_many", list(keys))
+
+    def cache_get(self, key):
+        try:
+            return self._read("get", key)
+        except StoreUnavailableError:
+            return self.primary.cache_get(key)
+
+    def cache_get_many(self, keys):
+        keys = list(keys)
+        try:
+            return self._read("get_many", keys)
+        except StoreUnavailableError:
+            return self.primary.cache_get_many(keys)
+
+    def cache_get_with_ttl(self, key):
+        try:
+            return self._read("get_with_ttl", key)
+        except StoreUnavailableError:
+            return self.primary.cache_get_with_ttl(key)
+
+    def get_with_ttl(self, key):
+        return self._read("get_with_ttl", key)
+
+    def cache_set(self, key, value, cache_duration=60):
+        self.primary.cache_set(key, value, cache_duration)
+
+    def cache_set_many(self, items, cache_duration=60):
+        self.primary.cache_set_many(items, cache_duration)
+
+    def set_many(self, items, cache_duration=None):
+        self.primary.set_many(items, cache_duration)
+
+    def expire_prefix(self, prefix, cache_duration):
+        return self.primary.expire_prefix(prefix, cache_duration)
+
+    def check(self):
+        for replica in self.replicas:
+            if replica.store.check():
+                replica.breaker.record_success()
+            else:
+                replica.breaker.record_failure()
+        return self.primary.check()
+
+    def choose_replicas(self):
+        """
+        Return healthy replicas in the order they should be tried.
+        """
+        healthy = [replica for replica in self.replicas if replica.breaker.allow()]
+        if len(healthy) > 2:
+            first, second = random.sample(healthy, 2)
+            best = first if first.latency <= second.latency else second
+            healthy.remove(best)
+            healthy.insert(0, best)
+        elif len(healthy) == 2 and healthy[1].latency < healthy[0].latency:
+            healthy.reverse()
+        return healthy
+
+    def _read(self, method, *args):
+        for replica in self.choose_replicas():
+            try:
+                return replica.read(method, *args)
+            except StoreUnavailableError as e:
+                logging.warning("Replica read failed, trying the next one: %s", e)
+        return getattr(self.primary, method)(*args)
+
+
+class HashRing:
+    """
+    Consistent hash ring. Every node is placed at `replicas` virtual points,
+    so adding or removing a node moves only about 1/N of the keys.
+    """
+
+    def __init__(self, nodes=(), replicas=160):
+        self.replicas = replicas
+        self._points = []  # Sorted virtual node hashes
+        self._owners = {}  # Virtual node hash -> node name
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def hash(key) -> int:
+        key = key.encode("utf-8") if isinstance(key, str) else bytes(key)
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big")
+
+    def add(self, node):
+        for i in range(self.replicas):
+            point = self.hash(f"{node}#{i}")
+            if point not in self._owners:
+                bisect.insort(self._points, point)
+                self._owners[point] = node
+
+    def remove(self, node):
+        self._points = [point for point in self._points if self._owners[point] != node]
+        self._owners = {point: owner for point, owner in self._owners.items() if owner != node}
+
+    def get(self, key):
+        if not self._points:
+            raise LookupError("Hash ring is empty")
+        index = bisect.bisect(self._points, self.hash(key)) % len(self._points)
+        return self._owners[self._points[index]]
+
+
+class ShardedStore(Store):
+    """
+    Spreads keys over several stores with a consistent hash ring.
+    Multi-key reads are split per shard and the shards are queried in parallel.
+    """
+
+    _shared = False
+
+    def __init__(self, nodes: dict, replicas=160, max_workers=None):
+        self.nodes = dict(nodes)
+        self.ring = HashRing(self.nodes, replicas)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or len(self.nodes) or 1)
+
+    def add_node(self, name, store):
+        self.nodes[name] = store
+        self.ring.add(name)
+
+    def remove_node(self, name):
+        self.ring.remove(name)
+        del self.nodes[name]
+
+    def node_for(self, key):
+        return self.nodes[self.ring.get(key)]
+
+    def get(self, key):
+        return self.node_for(key).get(key)
+
+    def get_many(self, keys):
+        return self._read_many(keys, "get_many")
+
+    def cache_get(self, key):
+        return self.node_for(key).cache_get(key)
+
+    def cache_get_many(self, keys):
+        return self._read_many(keys, "cache_get_many")
+
+    def cache_get_with_ttl(self, key):
+        return self.node_for(key).cache_get_with_ttl(key)
+
+    def get_with_ttl(self, key):
+        return self.node_for(key).get_with_ttl(key)
+
+    def cache_set(self, key, value, cache_duration=60):
+        self.node_for(key).cache_set(key, value, cache_duration)
+
+    def cache_set_many(self, items, cache_duration=60):
+        self._write_many(items, cache_duration, "cache_set_many")
+
+    def set_many(self, items, cache_duration=None):
+        self._write_many(items, cache_duration, "set_many")
+
+    def expire_prefix(self, prefix, cache_duration):
+        futures = [self._submit(node.expire_prefix, prefix, cache_duration) for node in self.nodes.values()]
+        return sum(future.result() for future in futures)
+
+    def check(self):
+        return all(node.check() for node in self.nodes.values())
+
+    def _submit(self, func, *args):
+        # Pool threads don't inherit context variables, the copy carries the request's stage timings
+        return self._executor.submit(contextvars.copy_context().run, func, *args)
+
+    def _write_many(self, items, cache_duration, method):
+        shards = {}  # node name -> its items
+        for key, value in items:
+            shards.setdefault(self.ring.get(key), []).append((key, value))
+        futures = [
+            self._submit(getattr(self.nodes[name], method), shard_items, cache_duration)
+            for name, shard_items in shards.items()
+        ]
+        for future in futures:
+            future.result()
+
+    def _read_many(self, keys, method):
+        keys = list(keys)
+        shards = {}  # node name -> positions of its keys
+        for position, key in enumerate(keys):
+            shards.setdefault(self.ring.get(key), []).append(position)
+        if len(shards) == 1:
+            ((name, positions),) = shards.items()
+            return getattr(self.nodes[name], method)(keys)
+        futures = {
+            name: self._submit(getattr(self.nodes[name], method), [keys[i] for i in positions])
+            for name, positions in shards.items()
+        }
+        values = [None] * len(keys)
+        for name, positions in shards.items():
+            for position, value in zip(positions, futures[name].result()):
+                values[position] = value
+        return values
+
+
+class ShardedRedisStore(ShardedStore):
+    """
+    ShardedStore over RedisStore nodes given as "host:port" strings or (host, port) pairs.
+    """
+
+    def __init__(self, addresses, replicas=160, **redis_options):
+        nodes = {}
+        for address in addresses:
+            host, port = address.rsplit(":", 1) if isinstance(address, str) else address
+            nodes[f"{host}:{port}"] = RedisStore(host=host, port=int(port), **redis_options)
+        super().__init__(nodes, replicas)
+
+
+BACKENDS = {
+    "redis": RedisStore,
+    "sharded": ShardedRedisStore,
+    "memory": InMemoryStore,
+    "shared": SharedMemoryStore,
+}
+
+
+def create_store(backend="redis", **options):
+    """
+    Build the store selected by configuration, e.g. create_store("redis", host="cache", port=6380).
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown store backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[backend](**options)
+
+
+def _estimate_size(value):
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        size += sum(sys.getsizeof(item) for item in value)
+    return size
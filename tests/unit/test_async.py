@@ -0,0 +1,34 @@
+import asyncio
+import json
+
+import pytest
+
+from scoring import api, asyncserver, store
+
+
+@pytest.fixture
+def async_store(mocker):
+    return mocker.AsyncMock(spec=store.AsyncStore)
+
+
+def test_online_score_async(set_valid_auth, async_store):
+    request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score"}
+    request["arguments"] = {"phone": "79175002040", "email": "stupnikov@otus.ru"}
+    set_valid_auth(request)
+    async_store.cache_get.return_value = None
+    response, code = asyncio.run(api.method_handler_async({"body": request, "headers": {}}, {}, async_store))
+    assert code == api.OK
+    assert response == {"score": 3.0}
+    async_store.cache_set.assert_awaited_once()
+
+
+def test_clients_interests_async(set_valid_auth, async_store):
+    request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests"}
+    request["arguments"] = {"client_ids": [1, 2]}
+    set_valid_auth(request)
+    async_store.get.return_value = None
+    async_store.get_many.return_value = [b'["a"]', ["b", "c"]]
+    body = json.dumps(request).encode("utf-8")
+    code, payload = asyncio.run(asyncserver.handle_request("POST", "/method/", {}, body, async_store))
+    assert code == api.OK
+    assert json.loads(payload) == {"response": {"1": ["a"], "2": ["b", "c"]}, "code": api.OK}
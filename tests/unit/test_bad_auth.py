@@ -34,3 +34,26 @@ def test_get_score_from_cache(set_valid_auth, arguments, mocker):
     mocker.patch.object(store1, "cache_get", return_value=43)
     response, code = api.method_handler({"body": request, "headers": {}}, {}, store1)
     assert response["score"] == 43
+
+
+def test_auth_cache_keeps_only_verified_credentials(set_valid_auth):
+    api.AUTH_CACHE.clear()
+    request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "arguments": {}}
+    set_valid_auth(request)
+    bad_request = dict(request, token="bad")
+    for _ in range(2):
+        _, code = api.method_handler({"body": bad_request, "headers": {}}, {}, {})
+        assert code == api.FORBIDDEN
+        _, code = api.method_handler({"body": request, "headers": {}}, {}, {})
+        assert code == api.INVALID_REQUEST
+    assert api.AUTH_CACHE.stats()["entries"] == 1
+
+
+def test_auth_cache_expiration():
+    cache = api.AuthCache(max_entries=1)
+    cache.add(("", "admin", "token"), expires_at=0)
+    assert not cache.is_verified(("", "admin", "token"))
+    cache.add(("a", "b", "c"))
+    cache.add(("d", "e", "f"))
+    assert not cache.is_verified(("a", "b", "c"))
+    assert cache.is_verified(("d", "e", "f"))
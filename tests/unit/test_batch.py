@@ -0,0 +1,53 @@
+from scoring import api, store
+
+
+def make_request(set_valid_auth, method, arguments, login="h&f"):
+    request = {"account": "horns&hoofs", "login": login, "method": method, "arguments": arguments}
+    set_valid_auth(request)
+    return request
+
+
+def test_batch(set_valid_auth, mocker):
+    batch_store = mocker.Mock(spec=store.Store)
+    batch_store.cache_get_many.return_value = [None, 4.0]
+    batch_store.get.return_value = None  # No interests version pointer
+    batch_store.get_many.return_value = [b'["a"]', None]
+    requests = [
+        make_request(set_valid_auth, "online_score", {"phone": "79175002040", "email": "stupnikov@otus.ru"}),
+        make_request(set_valid_auth, "online_score", {"first_name": "a", "last_name": "b"}),
+        make_request(set_valid_auth, "online_score", {"first_name": "a", "last_name": "b"}, login="admin"),
+        make_request(set_valid_auth, "clients_interests", {"client_ids": [1]}),
+        make_request(set_valid_auth, "clients_interests", {"client_ids": [1, 2]}),
+        make_request(set_valid_auth, "online_score", {"phone": "1"}),
+        dict(make_request(set_valid_auth, "online_score", {}), token="bad"),
+    ]
+    response, code = api.batch_handler({"body": requests, "headers": {}}, {}, batch_store)
+    assert code == api.OK
+    assert [item["code"] for item in response] == [200, 200, 200, 200, 422, 422, 403]
+    assert response[0]["response"] == {"score": 3.0}
+    assert response[1]["response"] == {"score": 4.0}
+    assert response[2]["response"] == {"score": 42}
+    assert response[3]["response"] == {"1": ["a"]}
+    batch_store.cache_get_many.assert_called_once()
+    batch_store.get_many.assert_called_once_with(["i:1", "i:2"])
+
+
+def test_batch_checks_credentials_once(set_valid_auth, mocker):
+    api.AUTH_CACHE.clear()
+    mocker.patch.multiple(api.AUTH_CACHE, hits=0, misses=0)
+    requests = [make_request(set_valid_auth, "unknown", {}) for _ in range(3)]
+    api.batch_handler({"body": requests, "headers": {}}, {}, mocker.Mock(spec=store.Store))
+    assert api.AUTH_CACHE.stats() == {"hits": 2, "misses": 1, "entries": 1}
+
+
+def test_batch_rejects_malformed_items(set_valid_auth, mocker):
+    requests = [
+        make_request(set_valid_auth, "online_score", [1]),
+        [1],
+        make_request(set_valid_auth, "online_score", {"first_name": "a", "last_name": "b"}, login="admin"),
+    ]
+    response, code = api.batch_handler({"body": requests, "headers": {}}, {}, mocker.Mock(spec=store.Store))
+    assert code == api.OK
+    assert [item["code"] for item in response] == [422, 422, 200]
+    _, code = api.method_handler({"body": requests[0], "headers": {}}, {}, mocker.Mock(spec=store.Store))
+    assert code == api.INVALID_REQUEST
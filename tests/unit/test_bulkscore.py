@@ -0,0 +1,48 @@
+import argparse
+import json
+
+import pytest
+
+import bulkscore
+from scoring import store
+
+
+def make_args(tmp_path, name, workers=0):
+    return argparse.Namespace(
+        input=str(tmp_path / name),
+        output=str(tmp_path / "scores.out"),
+        rejects=str(tmp_path / "rejects.jsonl"),
+        format=None,
+        workers=workers,
+        chunk_size=2,
+        progress_interval=60.0,
+        local_cache_mb=0,
+    )
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_scores_csv_and_rejects_invalid_rows(tmp_path, workers):
+    (tmp_path / "people.csv").write_text(
+        "phone,email,first_name,last_name,birthday,gender\n"
+        "79175002040,a@b.c,,,,\n"
+        "123,bad,,,,\n"
+        ",,,,01.01.1990,1\n"
+        ",,Ivan,,,\n",
+        encoding="utf-8",
+    )
+    args = make_args(tmp_path, "people.csv", workers)
+    progress = bulkscore.run(args, store.InMemoryStore(sweep_interval=0))
+    assert (progress.rows, progress.rejected) == (4, 2)
+    assert (tmp_path / "scores.out").read_text().splitlines() == ["line,score", "2,3.0", "4,1.5"]
+    rejects = [json.loads(line) for line in (tmp_path / "rejects.jsonl").read_text().splitlines()]
+    assert [(reject["line"], reject["row"]) for reject in rejects] == [
+        (3, {"phone": "123", "email": "bad"}),
+        (5, {"first_name": "Ivan"}),
+    ]
+
+
+def test_scores_jsonl(tmp_path):
+    (tmp_path / "people.jsonl").write_text('{"first_name": "a", "last_name": "b"}\n\n[]\n', encoding="utf-8")
+    progress = bulkscore.run(make_args(tmp_path, "people.jsonl"), store.InMemoryStore(sweep_interval=0))
+    assert (progress.rows, progress.rejected) == (2, 1)
+    assert json.loads((tmp_path / "scores.out").read_text()) == {"line": 1, "score": 0.5}
@@ -0,0 +1,32 @@
+from argparse import ArgumentParser
+
+import pytest
+
+from scoring import cli, store
+
+
+def test_build_store_uses_overrides(mocker):
+    parser = ArgumentParser()
+    cli.add_store_arguments(parser, redis_only=True)
+    args = parser.parse_args(["--redis-host", "cache", "--redis-port", "6380"])
+    create_store = mocker.patch.object(store, "create_store")
+    built = cli.build_store(args, redis_replicas="", local_cache_mb=0, value_format="json", legacy_pickle=False)
+    assert built is create_store.return_value
+    create_store.assert_called_once_with("redis", host="cache", port=6380, codec=store.JSON, legacy_pickle=False)
+
+
+def test_build_store_wraps_backend():
+    parser = ArgumentParser()
+    cli.add_store_arguments(parser)
+    memory = store.InMemoryStore(sweep_interval=0)
+    assert cli.build_store(parser.parse_args(["--store", "memory"]), memory) is memory
+    cached = cli.build_store(parser.parse_args(["--store", "memory", "--local-cache-mb", "1"]), memory)
+    assert isinstance(cached, store.LocalCacheStore) and cached.store is memory
+
+
+def test_pickle_format_needs_legacy_pickle():
+    parser = ArgumentParser()
+    cli.add_store_arguments(parser)
+    cli.check_store_arguments(parser, parser.parse_args(["--value-format", "pickle", "--legacy-pickle"]))
+    with pytest.raises(SystemExit):
+        cli.check_store_arguments(parser, parser.parse_args(["--value-format", "pickle"]))
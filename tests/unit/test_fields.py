@@ -0,0 +1,63 @@
+import datetime
+
+import pytest
+
+from scoring import api
+
+
+@pytest.mark.parametrize(
+    "arguments, message",
+    [
+        ({"phone": "89175002040", "email": "stupnikov@otus.ru"}, "Некорректный номер телефона"),
+        ({"phone": "79175002040", "email": "stupnikov"}, "Некорректный email"),
+        ({"gender": 1, "birthday": "01.01.1890"}, "Некорректная дата рождения"),
+        ({"gender": 1, "birthday": "1990-01-01"}, "Некорректный формат даты"),
+        ({"gender": 3, "birthday": "01.01.1990"}, "Некорректный пол"),
+        ({"first_name": 1, "last_name": "b"}, "Значение должно быть строкой"),
+        ({"first_name": "a"}, "Некорректный набор аргументов"),
+    ],
+)
+def test_online_score_validation_errors(arguments, message):
+    with pytest.raises(ValueError, match=message):
+        api.OnlineScoreRequest(arguments)
+
+
+def test_request_holds_plain_values():
+    request = api.OnlineScoreRequest({"phone": 79175002040, "email": "stupnikov@otus.ru"})
+    assert request.phone == "79175002040"
+    assert request.first_name == ""
+    assert request.gender is None
+    assert not hasattr(request, "__dict__")
+    assert list(api.OnlineScoreRequest.fields) == ["first_name", "last_name", "email", "phone", "birthday", "gender"]
+
+
+def test_method_request_requires_keys():
+    with pytest.raises(KeyError):
+        api.MethodRequest({"login": "h&f"})
+
+    class TracedMethodRequest(api.MethodRequest):
+        trace_id = api.CharField(required=False, nullable=True)
+
+    with pytest.raises(KeyError):
+        TracedMethodRequest({"login": "h&f"})
+
+
+@pytest.mark.parametrize(
+    "value",
+    ["01.01.1990", "1.1.1990", " 1.12.1990", "31.02.2000", "32.01.2000", "01.13.2000", "01.01.90", "1990-01-01"],
+)
+def test_parse_date_matches_strptime(value):
+    try:
+        expected = datetime.datetime.strptime(value, "%d.%m.%Y")
+    except ValueError:
+        with pytest.raises(ValueError):
+            api.parse_date(value)
+    else:
+        assert api.parse_date(value) == expected
+
+
+def test_birthday_cutoff():
+    cutoff = api.birthday_cutoff()
+    bound = datetime.datetime.today() - api.MAX_BIRTHDAY_AGE
+    assert cutoff.time() == datetime.time()
+    assert datetime.timedelta(0) <= cutoff - bound < datetime.timedelta(days=1)
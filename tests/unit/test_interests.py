@@ -0,0 +1,48 @@
+import pytest
+
+import scoring.scoring as scoring
+import scoring.store as store
+from scoring.bloom import BloomFilter
+
+
+def test_get_interests_many(mocker):
+    store1 = store.RedisStore()
+    mocker.patch.object(store1, "get", return_value=None)
+    get_many = mocker.patch.object(store1, "get_many", return_value=[b'["a","b"]', b'["c"]'])
+    assert scoring.get_interests_many(store1, [1, 2]) == {1: ["a", "b"], 2: ["c"]}
+    get_many.assert_called_once_with(["i:1", "i:2"])
+
+
+def test_get_interests_many_reports_all_missing(mocker):
+    store1 = store.RedisStore()
+    mocker.patch.object(store1, "get", return_value=None)
+    mocker.patch.object(store1, "get_many", return_value=[None, b'["c"]', None])
+    with pytest.raises(KeyError, match=r"\[1, 3\]"):
+        scoring.get_interests_many(store1, [1, 2, 3])
+
+
+def test_missing_ids_are_not_read_again(mocker):
+    memory = store.InMemoryStore(sweep_interval=0)
+    memory.cache_set("i:2", ["c"], None)
+    get = mocker.spy(memory, "get")
+    get_many = mocker.spy(memory, "get_many")
+    assert scoring.find_interests(memory, [1, 2]) == {1: None, 2: ["c"]}
+    with pytest.raises(KeyError, match=r"\[1\]"):
+        scoring.get_interests_many(memory, [1, 2])
+    with pytest.raises(KeyError):
+        scoring.get_interests(memory, 1)
+    assert get_many.call_count == 1
+    assert [call.args[0] for call in get.call_args_list].count("i:1") == 1
+
+    mocker.patch.object(scoring.time, "monotonic", return_value=scoring.time.monotonic() + scoring.NEGATIVE_CACHE_TTL)
+    memory.cache_set("i:1", ["a"], None)
+    assert scoring.find_interests(memory, [1, 2]) == {1: ["a"], 2: ["c"]}
+
+
+def test_bloom_filter_round_trip():
+    bloom = BloomFilter(1000, 0.01)
+    for cid in range(1000):
+        bloom.add(cid)
+    restored = BloomFilter.from_bytes(bloom.to_bytes())
+    assert all(cid in restored for cid in range(1000))
+    assert sum(cid in restored for cid in range(1000, 11000)) < 300
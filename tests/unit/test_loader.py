@@ -0,0 +1,73 @@
+import pytest
+
+import scoring.loader as loader
+import scoring.scoring as scoring
+import scoring.store as store
+
+
+def test_load_interests_switches_version_after_full_load(mocker):
+    mocker.patch.object(scoring, "INTERESTS_PREFIX_TTL", 0)
+    memory = store.InMemoryStore(sweep_interval=0)
+    memory.cache_set("i:1", ["legacy"], None)
+    assert scoring.get_interests(memory, 1) == ["legacy"]
+
+    records = ((cid, [f"v1-{cid}"]) for cid in range(25))
+    assert loader.load_interests(memory, records, version="v1", batch_size=4, workers=2) == ("v1", 25)
+    assert memory.cache_get(scoring.INTERESTS_POINTER) == "v1"
+    assert scoring.get_interests_many(memory, [1, 24]) == {1: ["v1-1"], 24: ["v1-24"]}
+
+    def broken_records():
+        yield 1, ["v2-1"]
+        raise ValueError("Line 2: expected an integer cid and a list of interests")
+
+    with pytest.raises(ValueError):
+        loader.load_interests(memory, broken_records(), version="v2", batch_size=1)
+    assert memory.cache_get("i:v2:1") is not None
+    assert scoring.get_interests(memory, 1) == ["v1-1"]
+
+
+@pytest.mark.parametrize("packed", [True, False])
+def test_loaded_interests_decode_like_legacy_json(mocker, packed):
+    memory = store.InMemoryStore(sweep_interval=0)
+    memory.cache_set("i:7", b'["books", "travel"]', None)
+    memory.cache_set("i:8", b"[]", None)
+    legacy = scoring.find_interests(memory, [7, 8])
+    assert legacy == {7: ["books", "travel"], 8: []}
+    records = [(7, ["books", "travel"]), (8, []), (9, ["travel"])]
+    loader.load_interests(memory, records, version="v3", packed=packed)
+    scoring._interests_prefixes.clear()
+    get = mocker.spy(memory, "get")
+    assert scoring.find_interests(memory, [7, 8, 9]) == {**legacy, 9: ["travel"]}
+    assert scoring.get_interests_many(memory, [9, 7, 8]) == {9: ["travel"], 7: ["books", "travel"], 8: []}
+    assert scoring.get_interests(memory, 8) == []
+    # The pointer, the Bloom filter key and the vocabulary are read once
+    metadata = [call.args[0] for call in get.call_args_list if not call.args[0][-1].isdigit()]
+    assert metadata == (["i:current", "i:v3:bloom", "i:v3:vocab"] if packed else ["i:current", "i:v3:bloom"])
+
+
+def test_loaded_bloom_filter_rejects_missing_ids(mocker):
+    memory = store.InMemoryStore(sweep_interval=0)
+    records = ((cid, ["books"]) for cid in range(0, 2000, 2))
+    loader.load_interests(memory, records, version="v4", packed=False, bloom_error_rate=0.01)
+    assert all(scoring.find_interests(memory, list(range(0, 2000, 2))).values())
+    get_many = mocker.spy(memory, "get_many")
+    for cid in range(1, 2000, 2):
+        assert scoring.find_interests(memory, [cid]) == {cid: None}
+    assert get_many.call_count < 30  # Only false positives reach the store
+    with pytest.raises(KeyError):
+        scoring.get_interests_many(memory, [2, 3])
+
+
+@pytest.mark.parametrize(
+    "memory", [store.InMemoryStore(sweep_interval=0), store.SharedMemoryStore(capacity=64)], ids=["memory", "shared"]
+)
+def test_ttl_expires_only_the_replaced_version(mocker, memory):
+    memory.cache_set("i:1", ["legacy"], None)
+    loader.load_interests(memory, [(1, ["v5"])], version="v5", ttl=1)
+    loader.load_interests(memory, [(1, ["v6"])], version="v6", ttl=1)
+    mocker.patch.object(store.time, "monotonic", return_value=store.time.monotonic() + 2)
+    mocker.patch.object(store.time, "time", return_value=store.time.time() + 2)
+    assert memory.get("i:v5:1") is None and memory.get("i:v5:vocab") is None
+    assert memory.get("i:1") == ["legacy"]
+    scoring._interests_prefixes.clear()
+    assert scoring.get_interests(memory, 1) == ["v6"]
@@ -0,0 +1,42 @@
+import io
+import json
+import logging
+import queue
+
+from scoring import logs
+
+
+def make_record(msg, *args, level=logging.INFO, **extra):
+    record = logging.LogRecord("test", level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_full_queue_drops_records_and_reports_them():
+    handler = logs.DroppingQueueHandler(queue.Queue(2))
+    for i in range(5):
+        handler.handle(make_record("request %d", i))
+    assert handler.dropped == 3
+    stream = io.StringIO()
+    listener = logs.BatchingListener(handler.queue, handler, stream, logging.Formatter("%(message)s"))
+    listener.start()
+    listener.stop()
+    assert stream.getvalue().splitlines() == ["request 0", "request 1", "3 log records dropped"]
+
+
+def test_sampling_applies_to_marked_records_only(mocker):
+    sampling = logs.SamplingFilter(0.1)
+    mocker.patch("random.random", return_value=0.5)
+    assert not sampling.filter(make_record({"code": 200}, sampled=True))
+    assert sampling.filter(make_record({"code": 422}, sampled=False))
+    assert sampling.filter(make_record("Starting server"))
+
+
+def test_json_formatter_puts_context_fields_on_top():
+    context = {"request_id": "abc", "code": 200, "has": {"phone": 1}.keys()}
+    entry = json.loads(logs.JsonFormatter().format(make_record(context)))
+    assert entry["level"] == "INFO"
+    assert (entry["request_id"], entry["code"], entry["has"]) == ("abc", 200, ["phone"])
+    assert (
+        json.loads(logs.JsonFormatter().format(make_record("%s: %s", "/method", b"{}")))["message"] == "/method: b'{}'"
+    )
@@ -0,0 +1,81 @@
+import asyncio
+import http.client
+import json
+import threading
+
+import pytest
+
+from scoring import api, asyncserver, metrics, server, store
+
+
+@pytest.fixture
+def enabled(mocker):
+    mocker.patch.object(metrics, "ENABLED", True)
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("latency_seconds", "Latency", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value, "auth")
+    assert histogram.render() == [
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{stage="auth",le="0.1"} 2',
+        'latency_seconds_bucket{stage="auth",le="1.0"} 3',
+        'latency_seconds_bucket{stage="auth",le="+Inf"} 4',
+        'latency_seconds_sum{stage="auth"} 2.65',
+        'latency_seconds_count{stage="auth"} 4',
+    ]
+
+
+def test_stages_are_noops_when_disabled():
+    assert metrics.stage("auth") is metrics.stage("parse")
+    assert metrics.start_request() is None
+
+
+def test_request_timings_are_logged(set_valid_auth, enabled, mocker, caplog):
+    mocker.patch.object(metrics.REQUESTS, "values", {})
+    request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score"}
+    request["arguments"] = {"phone": "79175002040", "email": "stupnikov@otus.ru"}
+    set_valid_auth(request)
+    async_store = mocker.AsyncMock(spec=store.AsyncStore)
+    async_store.cache_get.return_value = 3.0
+    with caplog.at_level("INFO"):
+        code, _ = asyncio.run(asyncserver.handle_request("POST", "/method", {}, json.dumps(request), async_store))
+    assert code == api.OK
+    assert {"parse", "validate", "auth", "encode"} <= caplog.records[-1].msg["timings"].keys()
+    assert metrics.REQUESTS.values == {("online_score", "200"): 1}
+
+
+def test_metrics_route(enabled):
+    httpd = server.ThreadPoolHTTPServer(("localhost", 0), api.MainHTTPHandler, workers=1)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        connection = http.client.HTTPConnection("localhost", httpd.server_address[1], timeout=5)
+        connection.request("POST", "/unknown", body='{"method": "online_score"}')
+        connection.getresponse().read()
+        connection.request("GET", "/metrics")
+        response = connection.getresponse()
+        assert response.status == api.OK
+        assert response.getheader("Content-Type") == metrics.CONTENT_TYPE
+        assert 'scoring_requests_total{method="other",code="404"}' in response.read().decode("utf-8")
+        connection.close()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_sharded_round_trips_count_in_request_timings(enabled, mocker):
+    mocker.patch.object(metrics.REQUESTS, "values", {})
+    mocker.patch.object(metrics.REQUEST_SECONDS, "values", {})
+
+    class TimedStore(store.InMemoryStore):
+        def get_many(self, keys):
+            with metrics.store_operation("mget"):
+                return super().get_many(keys)
+
+    sharded = store.ShardedStore({"a": TimedStore(sweep_interval=0), "b": TimedStore(sweep_interval=0)})
+    timings = metrics.start_request()
+    sharded.get_many([f"i:{cid}" for cid in range(50)])  # Keys of both nodes, read in pool threads
+    assert timings["store"] > 0
+    metrics.finish_request(timings, "clients_interests", api.OK, 0.0)
@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+import scoring.keys as keys
+import scoring.scoring as scoring
+import scoring.store as store
+
+
+def test_concurrent_misses_compute_score_once(mocker):
+    memory = store.InMemoryStore(sweep_interval=0)
+    compute = mocker.patch.object(scoring, "_compute_score", side_effect=lambda *args: time.sleep(0.05) or 3.0)
+    barrier = threading.Barrier(8)
+    scores = []
+
+    def score():
+        barrier.wait()
+        scores.append(scoring.get_score(memory, phone="79175002040", email="a@b.c"))
+
+    threads = [threading.Thread(target=score) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert scores == [3.0] * 8
+    assert compute.call_count == 1
+    assert scoring.score_flights.in_flight() == 0
+
+
+def test_early_refresh_recomputes_before_expiry(mocker):
+    memory = store.InMemoryStore(sweep_interval=0)
+    key = keys.score_key("79175002040", None, None, None)
+    memory.cache_set(key, 1.0, 60)
+    mocker.patch.object(scoring, "_compute_time", 1.0)
+    mocker.patch.object(scoring, "EARLY_REFRESH_BETA", 0.0)
+    assert scoring.get_score(memory, phone="79175002040") == 1.0
+    mocker.patch.object(scoring, "EARLY_REFRESH_BETA", 1e9)
+    assert scoring.get_score(memory, phone="79175002040") == 1.5
+    assert memory.cache_get_with_ttl(key)[1] > 60 * 59
+
+
+def test_scores_batch_matches_get_score():
+    np = pytest.importorskip("numpy")
+    rows = [
+        ("79175002040", "a@b.c", "01.01.1990", 1, "a", "b"),
+        (None, "", "01.01.1990", None, "a", None),
+        ("", None, None, 0, None, "b"),
+        ("79175002040", None, "01.01.1990", 0, "a", "b"),  # Same key as the first row
+    ]
+    expected = [scoring.get_score(store.InMemoryStore(sweep_interval=0), *row) for row in rows[:3]]
+    memory = store.InMemoryStore(sweep_interval=0)
+    scores = scoring.get_scores_batch(memory, *(np.array(column, dtype=object) for column in zip(*rows)), chunk_size=2)
+    assert scores.tolist() == expected + expected[:1]
+    assert scoring.get_scores_batch(memory, *zip(*rows)).tolist() == scores.tolist()
+    assert len(memory) == 3
+
+
+def test_scores_batch_accepts_numeric_phones():
+    np = pytest.importorskip("numpy")
+    memory = store.InMemoryStore(sweep_interval=0)
+    scores = scoring.get_scores_batch(memory, np.array([79175002040, 0]), email=["a@b.c", None])
+    assert scores.tolist() == [
+        scoring.get_score(store.InMemoryStore(sweep_interval=0), "79175002040", "a@b.c"),
+        scoring.get_score(store.InMemoryStore(sweep_interval=0), None, None),
+    ]
+    assert memory.cache_get(keys.score_key("79175002040", None, None, None)) == scores[0]
+
+
+def test_scores_batch_rejects_columns_of_different_lengths():
+    with pytest.raises(ValueError, match="equal lengths"):
+        scoring.get_scores_batch(store.InMemoryStore(sweep_interval=0), ["79175002040"], email=["a@b.c", None])
+
+
+def test_score_keys_keep_fields_apart():
+    assert keys.legacy_score_key(None, None, "ab", "c") == keys.legacy_score_key(None, None, "a", "bc")
+    assert keys.score_key(None, None, "ab", "c") != keys.score_key(None, None, "a", "bc")
+    assert keys.score_key("7", None, None, None) != keys.score_key(None, "7", None, None)
+    assert keys.score_key("7", "", None, None) == keys.score_key("7", None, "", None)
+    assert len(keys.score_key("79175002040", "01.01.1990", "Станислав", "Ступников")) == 18
+
+
+@pytest.mark.parametrize("read_legacy", [True, False])
+def test_scores_cached_under_legacy_keys(mocker, read_legacy):
+    mocker.patch.object(keys, "READ_LEGACY_KEYS", read_legacy)
+    memory = store.InMemoryStore(sweep_interval=0)
+    memory.cache_set(keys.legacy_score_key("79175002040", None, "a", "b"), 4.0, 60)
+    person = {"phone": "79175002040", "email": None, "birthday": None, "gender": None, "first_name": "a"}
+    person["last_name"] = "b"
+    expected = 4.0 if read_legacy else 2.0
+    assert scoring.get_scores(memory, [person, dict(person, phone=None)]) == [expected, 0.5]
+    memory.cache_set(keys.legacy_score_key("79175002041", None, "a", "b"), 4.0, 60)
+    assert scoring.get_score(memory, **dict(person, phone="79175002041")) == expected
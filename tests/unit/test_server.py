@@ -0,0 +1,161 @@
+import http.client
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from scoring import api, jsoncodec, server, store
+
+
+@pytest.fixture
+def start_server():
+    servers = []
+
+    def start(handler_class, **kwargs):
+        httpd = server.ThreadPoolHTTPServer(("localhost", 0), handler_class, **kwargs)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        servers.append(httpd)
+        return httpd.server_address[1]
+
+    yield start
+    for httpd in servers:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_thread_pool_server_handles_requests(start_server):
+    port = start_server(api.MainHTTPHandler, workers=2)
+    connection = http.client.HTTPConnection("localhost", port, timeout=5)
+    body = '{"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "", "arguments": {}}'
+    connection.request("POST", "/method", body=body, headers={"Content-Type": "application/json"})
+    assert connection.getresponse().status == api.FORBIDDEN
+
+
+def test_thread_pool_server_rejects_when_queue_is_full(start_server):
+    release = threading.Event()
+    started = threading.Event()
+
+    class SlowHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            started.set()
+            release.wait(5)
+            self.send_response(api.OK)
+            self.end_headers()
+
+    port = start_server(SlowHandler, workers=1, queue_size=0)
+    busy = http.client.HTTPConnection("localhost", port, timeout=5)
+    busy.request("GET", "/")
+    assert started.wait(5)
+    rejected = http.client.HTTPConnection("localhost", port, timeout=5)
+    rejected.request("GET", "/")
+    assert rejected.getresponse().status == api.SERVICE_UNAVAILABLE
+    release.set()
+    assert busy.getresponse().status == api.OK
+
+
+def test_keep_alive(start_server):
+    port = start_server(api.MainHTTPHandler, workers=2)
+    connection = http.client.HTTPConnection("localhost", port, timeout=5)
+    body = '{"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "", "arguments": {}}'
+    for _ in range(2):
+        connection.request("POST", "/method", body=body, headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        assert response.status == api.FORBIDDEN
+        response.read()
+    assert connection.sock is not None
+
+
+def test_idle_keep_alive_connections_dont_hold_workers(start_server):
+    port = start_server(api.MainHTTPHandler, workers=2)
+    body = '{"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "", "arguments": {}}'
+    connections = [http.client.HTTPConnection("localhost", port, timeout=2) for _ in range(5)]
+    for _ in range(2):  # Every connection stays open and idle while the next ones are served
+        for connection in connections:
+            connection.request("POST", "/method", body=body)
+            response = connection.getresponse()
+            assert response.status == api.FORBIDDEN
+            response.read()
+    assert all(connection.sock is not None for connection in connections)
+
+
+def test_pipelined_requests_are_served(start_server):
+    port = start_server(api.MainHTTPHandler, workers=1)
+    body = b'{"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "", "arguments": {}}'
+    request = b"POST /method HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body)
+    with socket.create_connection(("localhost", port), timeout=5) as sock:
+        sock.sendall(request * 2)
+        responses = b""
+        while responses.count(b"HTTP/1.1 403") < 2:
+            responses += sock.recv(65536)
+
+
+def test_http_0_9_request_gets_a_body(start_server):
+    port = start_server(api.MainHTTPHandler, workers=1)
+    with socket.create_connection(("localhost", port), timeout=5) as sock:
+        sock.sendall(b"GET /unknown\r\n\r\n")  # http.server reads headers after an HTTP/0.9 line too
+        response = b""
+        while chunk := sock.recv(65536):
+            response += chunk
+    assert json.loads(response) == {"error": "Not Found", "code": api.NOT_FOUND}
+
+
+@pytest.mark.parametrize("codec", list(jsoncodec.CODECS.values()), ids=list(jsoncodec.CODECS))
+def test_json_codecs_give_same_response(start_server, set_valid_auth, mocker, codec):
+    mocker.patch.object(api.MainHTTPHandler, "codec", codec)
+    mocker.patch.object(api.MainHTTPHandler, "store", store.InMemoryStore(sweep_interval=0))
+    port = start_server(api.MainHTTPHandler, workers=1)
+    request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score"}
+    request["arguments"] = {"phone": "79175002040", "email": "stupnikov@otus.ru", "first_name": "Станислав"}
+    set_valid_auth(request)
+    connection = http.client.HTTPConnection("localhost", port, timeout=5)
+    connection.request("POST", "/method", body=json.dumps(request, ensure_ascii=False).encode("utf-8"))
+    response = connection.getresponse()
+    assert response.getheader("Content-Length") == str(len(body := response.read()))
+    assert json.loads(body) == {"response": {"score": 3.0}, "code": api.OK}
+    connection.close()
+
+
+def test_large_clients_interests_are_streamed(start_server, set_valid_auth, mocker):
+    mocker.patch.object(api, "STREAM_THRESHOLD", 3)
+    mocker.patch.object(api, "STREAM_BATCH_SIZE", 2)
+    memory = store.InMemoryStore(sweep_interval=0)
+    for cid in (1, 2, 4, 5):
+        memory.cache_set(f"i:{cid}", [f"interest{cid}"], None)
+    mocker.patch.object(api.MainHTTPHandler, "store", memory)
+    port = start_server(api.MainHTTPHandler, workers=1)
+    request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests"}
+    request["arguments"] = {"client_ids": [1, 2, 3, 4, 5, 1]}
+    set_valid_auth(request)
+    expected = {"code": api.OK, "response": {str(cid): [f"interest{cid}"] for cid in (1, 2, 4, 5)}, "missing": [3]}
+    connection = http.client.HTTPConnection("localhost", port, timeout=5)
+    for _ in range(2):  # The connection stays usable after a chunked response
+        connection.request("POST", "/method", body=json.dumps(request))
+        response = connection.getresponse()
+        assert response.getheader("Transfer-Encoding") == "chunked"
+        assert json.loads(response.read()) == expected
+    connection.close()
+
+    # HTTP/1.0 has no chunked encoding, the body ends with the connection
+    body = json.dumps(request).encode("utf-8")
+    with socket.create_connection(("localhost", port), timeout=5) as sock:
+        sock.sendall(b"POST /method HTTP/1.0\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+        response = b"".join(iter(lambda: sock.recv(65536), b""))
+    head, body = response.split(b"\r\n\r\n", 1)
+    assert b"Transfer-Encoding" not in head
+    assert json.loads(body) == expected
+
+
+def test_clients_interests_are_not_streamed_by_default(start_server, set_valid_auth, mocker):
+    mocker.patch.object(api.MainHTTPHandler, "store", store.InMemoryStore(sweep_interval=0))
+    port = start_server(api.MainHTTPHandler, workers=1)
+    request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests"}
+    request["arguments"] = {"client_ids": list(range(20000))}
+    set_valid_auth(request)
+    connection = http.client.HTTPConnection("localhost", port, timeout=5)
+    connection.request("POST", "/method", body=json.dumps(request))
+    response = connection.getresponse()
+    assert response.status == api.INVALID_REQUEST
+    response.read()
+    connection.close()
@@ -1,3 +1,9 @@
+import multiprocessing
+import pickle
+import time
+
+import pytest
+
 from scoring import store
 
 
@@ -5,3 +11,209 @@ def test_singleton():
     store1 = store.RedisStore()
     store2 = store.RedisStore()
     assert store1 is store2
+
+
+def test_circuit_breaker_opens_after_threshold():
+    breaker = store.CircuitBreaker(failure_threshold=2, backoff_base=10)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.allow()
+
+
+def test_get_sends_single_command(mocker):
+    store1 = store.RedisStore(port=6390, health_interval=0)
+    ping = mocker.patch.object(store1.client, "ping")
+    get = mocker.patch.object(store1.client, "get", return_value=None)
+    assert store1.get("i:0") is None
+    get.assert_called_once_with("i:0")
+    ping.assert_not_called()
+
+
+def test_fail_fast_while_redis_is_down(mocker):
+    store1 = store.RedisStore(port=6391, health_interval=0, failure_threshold=1, backoff_base=10)
+    get = mocker.patch.object(store1.client, "get", side_effect=store.redis.ConnectionError)
+    assert store1.cache_get("uid:1") is None
+    assert store1.cache_get("uid:1") is None
+    assert get.call_count == 1
+    with pytest.raises(store.StoreUnavailableError):
+        store1.get("i:0")
+
+
+def test_local_cache_hit_and_ttl(mocker):
+    inner = mocker.Mock(spec=store.Store)
+    local = store.LocalCacheStore(inner)
+    local.cache_set("uid:1", 3.0, 60)
+    assert local.cache_get("uid:1") == 3.0
+    inner.cache_get.assert_not_called()
+    local.cache_set("uid:2", 1.5, 0)
+    inner.cache_get.return_value = None
+    assert local.cache_get("uid:2") is None
+    assert local.stats()["hits"] == 1
+    assert local.stats()["misses"] == 1
+
+
+def test_local_cache_evicts_least_recently_used(mocker):
+    local = store.LocalCacheStore(mocker.Mock(spec=store.Store), max_entries=2)
+    local.cache_set("a", 1.0)
+    local.cache_set("b", 2.0)
+    local.cache_get("a")
+    local.cache_set("c", 3.0)
+    assert local.stats()["evictions"] == 1
+    assert list(local._entries) == ["a", "c"]
+
+
+@pytest.mark.parametrize(
+    "codec, value",
+    [
+        (store.BINARY, 3.5),
+        (store.BINARY, 42),
+        (store.BINARY, b'["a","b"]'),
+        (store.BINARY, "text"),
+        (store.BINARY, ["books", "хобби", ""]),
+        (store.BINARY, []),
+        (store.JSON, ["books", "хобби"]),
+        (store.RAW, b'["a","b"]'),
+    ],
+)
+def test_codec_roundtrip(codec, value):
+    assert store.decode_value(store.encode_value(value, codec)) == value
+
+
+def test_legacy_pickle_values():
+    data = pickle.dumps(3.5)
+    assert store.decode_value(data, legacy_pickle=True) == 3.5
+    with pytest.raises(ValueError):
+        store.decode_value(data)
+
+
+def test_pickle_format_is_readable_by_old_versions():
+    data = store.encode_value(3.5, store.PICKLE)
+    assert pickle.loads(data) == 3.5  # What servers before the codecs do with every value
+    assert store.decode_value(data, legacy_pickle=True) == 3.5
+
+
+def test_in_memory_store_expiration():
+    memory = store.InMemoryStore(sweep_interval=0)
+    memory.cache_set("uid:1", 3.0, 60)
+    memory.cache_set("uid:2", 1.5, 0)
+    memory.cache_set("i:1", ["a"], None)
+    assert memory.cache_get("uid:1") == 3.0
+    assert memory.get_many(["uid:2", "i:1"]) == [None, ["a"]]
+    memory.cache_set("uid:3", 1.5, 0)
+    memory.sweep()
+    assert len(memory) == 2
+
+
+def test_shared_memory_store_is_shared_between_processes():
+    shared = store.SharedMemoryStore(capacity=64)
+    shared.cache_set("uid:0", 1.0)
+    context = multiprocessing.get_context("fork")
+    child = context.Process(target=shared.cache_set, args=("uid:1", 4.5, 60))
+    child.start()
+    child.join()
+    assert shared.get_many(["uid:0", "uid:1", "uid:2"]) == [1.0, 4.5, None]
+
+
+def test_shared_memory_store_replaces_entries_when_full():
+    shared = store.SharedMemoryStore(capacity=4, max_probes=4)
+    shared.cache_set("uid:expired", 0.0, 0)
+    for i in range(5):
+        shared.cache_set(f"uid:{i}", float(i), 60 + i)
+    assert shared.cache_get("uid:expired") is None
+    assert [shared.cache_get(f"uid:{i}") for i in range(5)] == [None, 1.0, 2.0, 3.0, 4.0]
+
+
+def test_shared_memory_store_rejects_oversize_values_in_set_many():
+    shared = store.SharedMemoryStore(capacity=64, max_value_size=16)
+    with pytest.raises(ValueError):
+        shared.set_many([("i:v1:1", ["a"]), ("i:v1:2", ["x" * 32])])
+    assert shared.get("i:v1:1") is None
+    shared.cache_set("i:v1:2", ["x" * 32])  # The cache only skips it
+    assert shared.get("i:v1:2") is None
+
+
+def test_shared_memory_store_expires_prefix(mocker):
+    shared = store.SharedMemoryStore(capacity=64)
+    shared.set_many([("i:v1:1", ["a"]), ("i:v1:2", ["b"]), ("i:v2:1", ["c"])])
+    shared.cache_set("i:v1:3", ["d"], 10)
+    assert shared.expire_prefix("i:v1:", 60) == 3
+    now = time.time()
+    mocker.patch("time.time", return_value=now + 30)
+    assert shared.get_many(["i:v1:1", "i:v1:3", "i:v2:1"]) == [["a"], None, ["c"]]
+    mocker.patch("time.time", return_value=now + 61)
+    assert shared.get_many(["i:v1:1", "i:v1:2", "i:v2:1"]) == [None, None, ["c"]]
+
+
+def test_hash_ring_moves_few_keys_when_node_added():
+    ring = store.HashRing(["a", "b", "c"])
+    keys = [f"uid:{i}" for i in range(3000)]
+    before = {key: ring.get(key) for key in keys}
+    assert set(before.values()) == {"a", "b", "c"}
+    ring.add("d")
+    moved = [key for key in keys if ring.get(key) != before[key]]
+    assert all(ring.get(key) == "d" for key in moved)
+    assert 0.15 < len(moved) / len(keys) < 0.35
+
+
+def test_sharded_store_splits_bulk_reads(mocker):
+    nodes = {name: store.InMemoryStore(sweep_interval=0) for name in ("a", "b")}
+    sharded = store.ShardedStore(nodes)
+    keys = [f"i:{i}" for i in range(20)]
+    for i, key in enumerate(keys):
+        sharded.cache_set(key, str(i), None)
+    assert all(len(node) for node in nodes.values())
+    spies = [mocker.spy(node, "get_many") for node in nodes.values()]
+    assert sharded.get_many(keys + ["i:missing"]) == [str(i) for i in range(20)] + [None]
+    assert [spy.call_count for spy in spies] == [1, 1]
+    assert sharded.cache_get("i:7") == "7"
+
+
+def test_replicated_store_reads_from_fastest_healthy_replica(mocker):
+    primary, fast, slow = (store.InMemoryStore(sweep_interval=0) for _ in range(3))
+    for node in (primary, fast, slow):
+        node.cache_set("uid:1", 1.0, None)
+    replicated = store.ReplicatedStore(primary, [fast, slow])
+    replicated.replicas[0].latency, replicated.replicas[1].latency = 0.001, 0.01
+    spy = mocker.spy(fast, "get")
+    assert replicated.cache_get("uid:1") == 1.0
+    assert spy.call_count == 1
+    replicated.cache_set("uid:2", 2.0)
+    assert primary.cache_get("uid:2") == 2.0
+    assert fast.cache_get("uid:2") is None
+
+
+def test_replicated_store_falls_back_to_primary(mocker):
+    primary, replica = store.InMemoryStore(sweep_interval=0), store.InMemoryStore(sweep_interval=0)
+    primary.cache_set("i:1", ["a"], None)
+    mocker.patch.object(replica, "get_many", side_effect=store.StoreUnavailableError)
+    replicated = store.ReplicatedStore(primary, [replica], failure_threshold=1, backoff_base=60)
+    assert replicated.get_many(["i:1"]) == [["a"]]
+    assert replicated.choose_replicas() == []
+    assert replicated.get_many(["i:1"]) == [["a"]]
+    assert replica.get_many.call_count == 1
+
+
+def test_replicated_store_reads_ttl_from_primary_when_replicas_fail(mocker):
+    primary, replica = store.InMemoryStore(sweep_interval=0), store.InMemoryStore(sweep_interval=0)
+    primary.cache_set("uid:1", 9.0, 60)
+    mocker.patch.object(replica, "get_with_ttl", side_effect=store.StoreUnavailableError)
+    replicated = store.ReplicatedStore(primary, [replica], failure_threshold=1, backoff_base=60)
+    value, ttl = replicated.cache_get_with_ttl("uid:1")
+    assert value == 9.0 and 59 < ttl <= 60
+    assert replicated.choose_replicas() == []
+
+
+def test_redis_expire_prefix_scans_all_pages(mocker):
+    redis_store = store.RedisStore()
+    pages = iter([(7, [b"i:v[1]:1", b"i:v[1]:2"]), (0, [b"i:v[1]:vocab"])])
+    execute = mocker.patch.object(redis_store, "_execute", side_effect=lambda *args: next(pages))
+    pipeline = mocker.patch.object(redis_store, "_execute_pipeline")
+    assert redis_store.expire_prefix("i:v[1]:", 60) == 3
+    assert [call.args for call in execute.call_args_list] == [
+        ("scan", 0, "i:v\\[1\\]:*", 1000),
+        ("scan", 7, "i:v\\[1\\]:*", 1000),
+    ]
+    assert pipeline.call_args_list[1].args[0] == [("expire", b"i:v[1]:vocab", 60)]